@@ -0,0 +1,69 @@
+"""
+Measures RedisBackend publish throughput for different batch windows.
+
+Run from the backend directory against a local Redis:
+
+    python -m benchmarks.broadcast_publish --url redis://localhost:6379
+"""
+
+import argparse
+import asyncio
+import time
+
+from src.chat.service import RedisBackend
+
+MESSAGE = '{"type": "message", "body": {"content": "' + "x" * 200 + '"}}'
+
+
+async def publisher(backend: RedisBackend, channel: str, messages: int) -> None:
+    for _ in range(messages):
+        await backend.publish(channel, MESSAGE)
+
+
+async def measure(args: argparse.Namespace, batch_window: float) -> float:
+    backend = RedisBackend(
+        args.url,
+        pool_size=args.pool_size,
+        batch_size=args.batch_size,
+        batch_window=batch_window,
+    )
+    await backend.connect()
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(
+                publisher(backend, f"benchmark:{i}", args.messages)
+                for i in range(args.publishers)
+            ),
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        await backend.disconnect()
+
+    return args.publishers * args.messages / elapsed
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="redis://localhost:6379")
+    parser.add_argument(
+        "--windows",
+        type=float,
+        nargs="+",
+        default=[0, 0.0005, 0.001, 0.002, 0.005],
+        help="batch windows to compare, in seconds",
+    )
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--publishers", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{'window, ms':>10} {'messages/sec':>14}")  # noqa: T201
+    for window in args.windows:
+        rate = await measure(args, batch_window=window)
+        print(f"{window * 1000:>10.2f} {rate:>14.0f}")  # noqa: T201
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
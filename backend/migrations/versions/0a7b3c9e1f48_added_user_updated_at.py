@@ -0,0 +1,39 @@
+"""Added User.updated_at for listing validators
+
+Revision ID: 0a7b3c9e1f48
+Revises: f2a6c8d4e5b7
+Create Date: 2026-10-18 14:30:00.000000
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "0a7b3c9e1f48"
+down_revision = "f2a6c8d4e5b7"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "user",
+        sa.Column(
+            "updated_at",
+            sa.DateTime(),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+    )
+    op.create_index(
+        "ix_user_id_updated_at",
+        "user",
+        ["id", "updated_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_user_id_updated_at", table_name="user")
+    op.drop_column("user", "updated_at")
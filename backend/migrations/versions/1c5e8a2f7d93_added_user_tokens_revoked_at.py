@@ -0,0 +1,27 @@
+"""Added User.tokens_revoked_at for signed access tokens
+
+Revision ID: 1c5e8a2f7d93
+Revises: 0a7b3c9e1f48
+Create Date: 2026-10-18 15:10:00.000000
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "1c5e8a2f7d93"
+down_revision = "0a7b3c9e1f48"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "user",
+        sa.Column("tokens_revoked_at", sa.DateTime(timezone=True), nullable=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("user", "tokens_revoked_at")
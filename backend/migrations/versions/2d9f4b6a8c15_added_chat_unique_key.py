@@ -0,0 +1,55 @@
+"""Added Chat.unique_key for duplicate dialogue detection
+
+Revision ID: 2d9f4b6a8c15
+Revises: 1c5e8a2f7d93
+Create Date: 2026-10-18 15:40:00.000000
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "2d9f4b6a8c15"
+down_revision = "1c5e8a2f7d93"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column("chat", sa.Column("unique_key", sa.String(length=64), nullable=True))
+    # only the oldest of already duplicated chats gets the key
+    op.execute(
+        """
+        UPDATE chat
+        SET unique_key = keys.unique_key
+        FROM (
+            SELECT
+                chat_id,
+                unique_key,
+                row_number() OVER (PARTITION BY unique_key ORDER BY chat_id) AS n
+            FROM (
+                SELECT
+                    chat.id AS chat_id,
+                    CASE chat.type
+                        WHEN 'DIALOGUE' THEN 'dialogue:'
+                            || min(chat_participant.participant_id) || ':'
+                            || max(chat_participant.participant_id)
+                        ELSE 'saved_messages:'
+                            || min(chat_participant.participant_id)
+                    END AS unique_key
+                FROM chat
+                JOIN chat_participant ON chat_participant.chat_id = chat.id
+                WHERE chat.type IN ('DIALOGUE', 'SAVED_MESSAGES')
+                GROUP BY chat.id
+            ) AS chat_keys
+        ) AS keys
+        WHERE chat.id = keys.chat_id AND keys.n = 1
+        """,
+    )
+    op.create_index("ix_chat_unique_key", "chat", ["unique_key"], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_chat_unique_key", table_name="chat")
+    op.drop_column("chat", "unique_key")
@@ -0,0 +1,202 @@
+"""Partitioned Message by month of creation
+
+Revision ID: 3e7a1d5c9b02
+Revises: 2d9f4b6a8c15
+Create Date: 2026-10-18 16:20:00.000000
+
+"""
+
+from datetime import UTC, datetime
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "3e7a1d5c9b02"
+down_revision = "2d9f4b6a8c15"
+branch_labels = None
+depends_on = None
+
+# partitions following the legacy one, more are created on startup
+MONTHS_AHEAD = 3
+
+COLUMNS = "id, author_id, sender_id, chat_id, type, content, is_edited, created_at"
+
+
+def next_month(value: datetime) -> datetime:
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1)  # noqa: DTZ001
+
+
+def replace_chat_foreign_key() -> None:
+    """
+    Makes sure the chat foreign key of the existing table matches the one of
+    the partitioned table, so that attaching reuses it. Otherwise a new one
+    would be added and validated over the whole table while holding the lock.
+    """
+    connection = op.get_bind()
+    # ON DELETE CASCADE has been set by 7fcef6a19bf6, unless changed by hand
+    names = connection.scalars(
+        sa.text(
+            "SELECT conname FROM pg_constraint "
+            "WHERE conrelid = 'message'::regclass AND confrelid = 'chat'::regclass "
+            "AND contype = 'f' AND confdeltype <> 'c'",
+        ),
+    ).all()
+    if not names:
+        return
+
+    # validated separately, so that writes are not blocked meanwhile
+    op.execute(
+        "ALTER TABLE message ADD CONSTRAINT message_legacy_chat_id_fkey "
+        "FOREIGN KEY (chat_id) REFERENCES chat (id) ON DELETE CASCADE NOT VALID",
+    )
+    op.execute("ALTER TABLE message VALIDATE CONSTRAINT message_legacy_chat_id_fkey")
+    for name in names:
+        op.drop_constraint(name, "message", type_="foreignkey")
+
+
+def upgrade() -> None:
+    # the existing table becomes the partition of messages created before that
+    legacy_upper = next_month(datetime.now(UTC))
+
+    # everything that attaching the table would otherwise build or check
+    # while holding the lock, is done without blocking writes beforehand
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "message_legacy_id_created_at_key",
+            "message",
+            ["id", "created_at"],
+            unique=True,
+            postgresql_concurrently=True,
+        )
+        # attaching only reuses an index that backs a primary key constraint,
+        # so the constraint is moved onto the new index, which takes its name
+        op.execute(
+            "ALTER TABLE message DROP CONSTRAINT message_pkey, "
+            "ADD CONSTRAINT message_pkey PRIMARY KEY "
+            "USING INDEX message_legacy_id_created_at_key",
+        )
+        op.execute(
+            "ALTER TABLE message ADD CONSTRAINT message_legacy_created_at_check "
+            f"CHECK (created_at < '{legacy_upper}') NOT VALID",
+        )
+        op.execute(
+            "ALTER TABLE message VALIDATE CONSTRAINT message_legacy_created_at_check",
+        )
+        replace_chat_foreign_key()
+
+    op.rename_table("message", "message_legacy")
+    op.execute(
+        "ALTER TABLE message_legacy "
+        "RENAME CONSTRAINT message_pkey TO message_legacy_pkey",
+    )
+    op.execute(
+        "ALTER INDEX ix_message_chat_id_created_at_id "
+        "RENAME TO message_legacy_chat_id_created_at_id_idx",
+    )
+    op.execute(
+        "ALTER INDEX ix_message_search_vector "
+        "RENAME TO message_legacy_search_vector_idx",
+    )
+
+    op.create_table(
+        "message",
+        sa.Column(
+            "id",
+            sa.Integer(),
+            server_default=sa.text("nextval('message_id_seq'::regclass)"),
+            nullable=False,
+        ),
+        sa.Column("author_id", sa.Integer(), nullable=False),
+        sa.Column("sender_id", sa.Integer(), nullable=False),
+        sa.Column("chat_id", sa.Integer(), nullable=False),
+        sa.Column(
+            "type",
+            postgresql.ENUM(
+                "TEXT",
+                "VOICE",
+                "FILE",
+                name="message_type",
+                create_type=False,
+            ),
+            nullable=False,
+        ),
+        sa.Column("content", sa.Text(), nullable=False),
+        sa.Column("is_edited", sa.Boolean(), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column(
+            "search_vector",
+            postgresql.TSVECTOR(),
+            sa.Computed("to_tsvector('simple', content)", persisted=True),
+            nullable=True,
+        ),
+        sa.ForeignKeyConstraint(["author_id"], ["user.id"]),
+        sa.ForeignKeyConstraint(["chat_id"], ["chat.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["sender_id"], ["user.id"]),
+        sa.PrimaryKeyConstraint("id", "created_at"),
+        postgresql_partition_by="RANGE (created_at)",
+    )
+    op.execute("ALTER SEQUENCE message_id_seq OWNED BY message.id")
+    # the existing indexes of the legacy table are attached to these
+    op.create_index(
+        "ix_message_chat_id_created_at_id",
+        "message",
+        ["chat_id", "created_at", "id"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_message_search_vector",
+        "message",
+        ["search_vector"],
+        unique=False,
+        postgresql_using="gin",
+    )
+
+    op.execute(
+        "ALTER TABLE message ATTACH PARTITION message_legacy "
+        f"FOR VALUES FROM (MINVALUE) TO ('{legacy_upper}')",
+    )
+    op.execute(
+        "ALTER TABLE message_legacy DROP CONSTRAINT message_legacy_created_at_check",
+    )
+
+    lower = legacy_upper
+    for _ in range(MONTHS_AHEAD):
+        upper = next_month(lower)
+        op.execute(
+            f"CREATE TABLE message_p{lower:%Y_%m} PARTITION OF message "
+            f"FOR VALUES FROM ('{lower}') TO ('{upper}')",
+        )
+        lower = upper
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE message DETACH PARTITION message_legacy")
+    op.rename_table("message", "message_partitioned")
+    op.rename_table("message_legacy", "message")
+    op.execute(
+        f"INSERT INTO message ({COLUMNS}) "  # noqa: S608
+        f"SELECT {COLUMNS} FROM message_partitioned",
+    )
+    op.execute("ALTER SEQUENCE message_id_seq OWNED BY message.id")
+    # drops the remaining partitions as well
+    op.drop_table("message_partitioned")
+
+    op.execute(
+        "ALTER TABLE message DROP CONSTRAINT message_legacy_pkey, "
+        "ADD CONSTRAINT message_pkey PRIMARY KEY (id)",
+    )
+    op.execute(
+        "ALTER INDEX message_legacy_chat_id_created_at_id_idx "
+        "RENAME TO ix_message_chat_id_created_at_id",
+    )
+    op.execute(
+        "ALTER INDEX message_legacy_search_vector_idx "
+        "RENAME TO ix_message_search_vector",
+    )
@@ -0,0 +1,36 @@
+"""Added (chat_id, created_at, id) index on message for keyset pagination
+
+Revision ID: b5d1e3a7c920
+Revises: 7fcef6a19bf6
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b5d1e3a7c920"
+down_revision = "7fcef6a19bf6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # built concurrently to not lock writes to a large message table
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_message_chat_id_created_at_id",
+            "message",
+            ["chat_id", "created_at", "id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_message_chat_id_created_at_id",
+            table_name="message",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,58 @@
+"""Replaced Message.is_read with read watermarks and unread counters
+
+Revision ID: c3f0a9d2e418
+Revises: b5d1e3a7c920
+Create Date: 2026-10-18 12:30:00.000000
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c3f0a9d2e418"
+down_revision = "b5d1e3a7c920"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "chat_participant",
+        sa.Column("last_read_message_id", sa.Integer(), nullable=True),
+    )
+    op.add_column(
+        "chat_participant",
+        sa.Column("unread_count", sa.Integer(), server_default="0", nullable=False),
+    )
+    op.create_index(
+        "ix_chat_participant_participant_id",
+        "chat_participant",
+        ["participant_id"],
+        unique=False,
+    )
+    # is_read was shared by all participants, count messages of the others
+    # that are not read yet as unread
+    op.execute(
+        """
+        UPDATE chat_participant cp
+        SET unread_count = (
+            SELECT count(*) FROM message m
+            WHERE m.chat_id = cp.chat_id
+            AND m.author_id != cp.participant_id
+            AND NOT m.is_read
+        )
+        """,
+    )
+    op.drop_column("message", "is_read")
+
+
+def downgrade() -> None:
+    op.add_column(
+        "message",
+        sa.Column("is_read", sa.Boolean(), server_default="false", nullable=False),
+    )
+    op.alter_column("message", "is_read", server_default=None)
+    op.drop_index("ix_chat_participant_participant_id", table_name="chat_participant")
+    op.drop_column("chat_participant", "unread_count")
+    op.drop_column("chat_participant", "last_read_message_id")
@@ -0,0 +1,78 @@
+"""Added ChatSummary model
+
+Revision ID: d8e2b61f5a03
+Revises: c3f0a9d2e418
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "d8e2b61f5a03"
+down_revision = "c3f0a9d2e418"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "chat_summary",
+        sa.Column("chat_id", sa.Integer(), nullable=False),
+        sa.Column("last_message_id", sa.Integer(), nullable=True),
+        sa.Column("last_message_at", sa.DateTime(), nullable=True),
+        sa.Column("last_author_id", sa.Integer(), nullable=True),
+        sa.Column("message_count", sa.Integer(), server_default="0", nullable=False),
+        sa.Column(
+            "last_activity_at",
+            sa.DateTime(),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(["chat_id"], ["chat.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["last_author_id"], ["user.id"], ondelete="SET NULL"),
+        sa.PrimaryKeyConstraint("chat_id"),
+    )
+    op.create_index(
+        "ix_chat_summary_last_activity_at",
+        "chat_summary",
+        ["last_activity_at", "chat_id"],
+        unique=False,
+    )
+    # same as `python -m src.chat.commands rebuild-summaries`
+    op.execute(
+        """
+        INSERT INTO chat_summary (
+            chat_id,
+            last_message_id,
+            last_message_at,
+            last_author_id,
+            message_count,
+            last_activity_at
+        )
+        SELECT
+            chat.id,
+            last_message.id,
+            last_message.created_at,
+            last_message.author_id,
+            message_count.count,
+            coalesce(last_message.created_at, chat.created_at)
+        FROM chat
+        LEFT JOIN LATERAL (
+            SELECT id, created_at, author_id FROM message
+            WHERE message.chat_id = chat.id
+            ORDER BY id DESC
+            LIMIT 1
+        ) AS last_message ON true
+        JOIN LATERAL (
+            SELECT count(*) AS count FROM message
+            WHERE message.chat_id = chat.id
+        ) AS message_count ON true
+        """,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_chat_summary_last_activity_at", table_name="chat_summary")
+    op.drop_table("chat_summary")
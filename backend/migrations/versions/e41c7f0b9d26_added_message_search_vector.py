@@ -0,0 +1,56 @@
+"""Added Message.search_vector with GIN index for full-text search
+
+Adding a stored generated column rewrites the whole message table under an
+ACCESS EXCLUSIVE lock, which blocks both reads and writes of messages until
+it's done, so on large tables this migration needs a maintenance window.
+The column can't be filled in batches by a trigger instead, as partitions
+of the message table must have it generated like their parent.
+
+Revision ID: e41c7f0b9d26
+Revises: d8e2b61f5a03
+Create Date: 2026-10-18 13:30:00.000000
+
+"""
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "e41c7f0b9d26"
+down_revision = "d8e2b61f5a03"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "message",
+        sa.Column(
+            "search_vector",
+            postgresql.TSVECTOR(),
+            sa.Computed("to_tsvector('simple', content)", persisted=True),
+            nullable=True,
+        ),
+    )
+    # the rewrite above already took the table lock, the index is built
+    # concurrently so that it's not held any longer than that
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_message_search_vector",
+            "message",
+            ["search_vector"],
+            unique=False,
+            postgresql_using="gin",
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_message_search_vector",
+            table_name="message",
+            postgresql_concurrently=True,
+        )
+    op.drop_column("message", "search_vector")
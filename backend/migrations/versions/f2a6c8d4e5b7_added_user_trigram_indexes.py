@@ -0,0 +1,42 @@
+"""Added trigram indexes on User names for search
+
+Revision ID: f2a6c8d4e5b7
+Revises: e41c7f0b9d26
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "f2a6c8d4e5b7"
+down_revision = "e41c7f0b9d26"
+branch_labels = None
+depends_on = None
+
+COLUMNS = ("username", "first_name", "last_name")
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    with op.get_context().autocommit_block():
+        for column in COLUMNS:
+            op.create_index(
+                f"ix_user_{column}_trgm",
+                "user",
+                [column],
+                unique=False,
+                postgresql_using="gin",
+                postgresql_ops={column: "gin_trgm_ops"},
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for column in COLUMNS:
+            op.drop_index(
+                f"ix_user_{column}_trgm",
+                table_name="user",
+                postgresql_concurrently=True,
+            )
@@ -0,0 +1,20 @@
+# number of users found by search by default and at most
+USER_SEARCH_LIMIT = 20
+USER_SEARCH_MAX_LIMIT = 50
+USER_SEARCH_QUERY_MAX_LENGTH = 64
+# search results are cached for a few seconds to absorb repeated keystrokes
+USER_SEARCH_CACHE_TTL = 5
+USER_SEARCH_CACHE_SIZE = 1024
+
+# number of users returned per page of the listing by default and at most
+USERS_PAGE_SIZE = 100
+USERS_PAGE_MAX_SIZE = 1000
+# users fetched per query while streaming the whole listing
+USERS_STREAM_BATCH_SIZE = 1000
+
+# users resolved from access tokens are cached for a short time, so that
+# changes to them are picked up soon without invalidating the cache
+TOKEN_CACHE_TTL = 30
+TOKEN_CACHE_SIZE = 10000
+# broadcast channel which evicts users' cached tokens on all nodes
+TOKEN_INVALIDATION_CHANNEL = "auth:tokens"  # noqa: S105
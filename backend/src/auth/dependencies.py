@@ -1,24 +1,27 @@
-from fastapi import Depends, HTTPException
+from datetime import UTC, datetime
+
+from fastapi import Depends, HTTPException, status
 
 from src.database import AsyncSession, get_db_session
 
-from .enums import TokenType
+from .exceptions import TokenExpiredHTTPException
 from .models import User
-from .service import oauth2_scheme
-from .utils import get_token
+from .service import oauth2_scheme, token_cache
+from .utils import get_access_token_user
 
 
 async def get_current_user(
     session: AsyncSession = Depends(get_db_session),
     token: str = Depends(oauth2_scheme),
 ) -> User:
-    access_token = await get_token(
-        token=token,
-        token_type=TokenType.ACCESS,
-        session=session,
-    )
+    cached_token = token_cache.get(token)
+    if cached_token is None:
+        user, expires, issued_at = await get_access_token_user(token, session)
+        cached_token = token_cache.set(token, user, expires, issued_at)
+    elif cached_token.expires <= datetime.now(UTC):
+        raise TokenExpiredHTTPException
 
-    return access_token.user
+    return token_cache.get_user(cached_token)
 
 
 async def get_current_active_user(
@@ -27,3 +30,14 @@ async def get_current_active_user(
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
+
+
+async def get_current_admin_user(
+    current_user: User = Depends(get_current_active_user),
+) -> User:
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions",
+        )
+    return current_user
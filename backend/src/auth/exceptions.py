@@ -17,3 +17,12 @@ class TokenExpiredHTTPException(HTTPException):
             detail="Token has expired",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+
+class PasswordHasherBusyHTTPException(HTTPException):
+    def __init__(self: "PasswordHasherBusyHTTPException") -> None:
+        super().__init__(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many logins, try again later",
+            headers={"Retry-After": "1"},
+        )
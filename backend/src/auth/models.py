@@ -4,12 +4,14 @@ from typing import TYPE_CHECKING
 from sqlalchemy import (
     DateTime,
     ForeignKey,
+    Index,
     String,
     Text,
     UniqueConstraint,
 )
 from sqlalchemy.dialects.postgresql import ENUM
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.sql import func
 
 from src.database import Base
 from src.models import CreatedAtMixin, IdMixin
@@ -22,6 +24,20 @@ if TYPE_CHECKING:
 
 class User(IdMixin, CreatedAtMixin, Base):
     __tablename__ = "user"
+    __table_args__ = (
+        # user search matches substrings, prefixes and similar words of names
+        *(
+            Index(
+                f"ix_user_{column}_trgm",
+                column,
+                postgresql_using="gin",
+                postgresql_ops={column: "gin_trgm_ops"},
+            )
+            for column in ("username", "first_name", "last_name")
+        ),
+        # listing validators are computed with an index-only scan
+        Index("ix_user_id_updated_at", "id", "updated_at"),
+    )
 
     username: Mapped[str] = mapped_column(index=True, unique=True)
     first_name: Mapped[str] = mapped_column(default="")
@@ -30,6 +46,16 @@ class User(IdMixin, CreatedAtMixin, Base):
     last_online: Mapped[datetime | None] = mapped_column(default=None)
     is_active: Mapped[bool] = mapped_column(default=False)
     is_admin: Mapped[bool] = mapped_column(default=False)
+    # signed access tokens issued before this time are revoked
+    tokens_revoked_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True),
+        default=None,
+    )
+    # validates cached user listings, so it's updated with every change
+    updated_at: Mapped[datetime] = mapped_column(
+        server_default=func.now(),
+        onupdate=func.now(),
+    )
 
     tokens: Mapped[list["Token"]] = relationship("Token", back_populates="user")
     chats: Mapped[list["ChatParticipant"]] = relationship(
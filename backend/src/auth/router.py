@@ -1,27 +1,61 @@
-from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi import (
+    APIRouter,
+    Depends,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    status,
+)
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy import and_, select
 
-from src.chat.models import Chat, ChatParticipant, ChatType
+from src.chat.models import Chat, ChatParticipant, ChatSummary, ChatType
+from src.chat.utils import get_chat_unique_key
 from src.database import AsyncSession, get_db_session
 from src.schemas import ClientErrorResponse
 
-from .dependencies import get_current_active_user
+from .constants import (
+    USER_SEARCH_LIMIT,
+    USER_SEARCH_MAX_LIMIT,
+    USER_SEARCH_QUERY_MAX_LENGTH,
+    USERS_PAGE_MAX_SIZE,
+    USERS_PAGE_SIZE,
+)
+from .dependencies import get_current_active_user, get_current_admin_user
 from .enums import TokenType
 from .models import User
-from .schemas import TokenResponse, UserCreate, UserRead
-from .service import oauth2_scheme
+from .schemas import (
+    PasswordHasherStats,
+    TokenCacheStats,
+    TokenResponse,
+    UserCreate,
+    UserPage,
+    UserRead,
+)
+from .service import oauth2_scheme, password_hasher, token_cache
 from .utils import (
     authenticate_user,
     create_access_token,
     create_refresh_token,
     delete_user_tokens,
+    find_users,
     get_password_hash,
     get_token,
     get_user,
+    get_users_page,
+    get_users_page_validators,
+    get_validator_headers,
+    is_not_modified,
+    stream_users,
 )
 
-router = APIRouter(prefix="/api/v1", tags=["auth"])
+router = APIRouter(
+    prefix="/api/v1",
+    tags=["auth"],
+    on_startup=[token_cache.start],
+    on_shutdown=[token_cache.stop, password_hasher.stop],
+)
 
 
 @router.post(
@@ -37,6 +71,10 @@ router = APIRouter(prefix="/api/v1", tags=["auth"])
             "description": "Username is already taken",
             "model": ClientErrorResponse,
         },
+        503: {
+            "description": "Too many passwords are being hashed",
+            "model": ClientErrorResponse,
+        },
     },
 )
 async def register(  # noqa: ANN201
@@ -62,7 +100,7 @@ async def register(  # noqa: ANN201
         )
 
     # hash the password
-    user.password = get_password_hash(user.password)
+    user.password = await get_password_hash(user.password)
     del user.password_confirm
 
     # non-schema fields
@@ -80,6 +118,8 @@ async def register(  # noqa: ANN201
         name="",
         type=ChatType.SAVED_MESSAGES,
         image_url="",
+        unique_key=get_chat_unique_key(ChatType.SAVED_MESSAGES, [new_user.id]),
+        summary=ChatSummary(),
     )
     session.add(saved_messages_chat)
     saved_messages_chat.participants.append(
@@ -101,6 +141,10 @@ async def register(  # noqa: ANN201
             "description": "Incorrect username or password",
             "model": ClientErrorResponse,
         },
+        503: {
+            "description": "Too many passwords are being hashed",
+            "model": ClientErrorResponse,
+        },
     },
 )
 async def token(  # noqa: ANN201
@@ -130,7 +174,7 @@ async def token(  # noqa: ANN201
     )
 
     return {
-        "access_token": access_token.token,
+        "access_token": access_token,
         "refresh_token": refresh_token.token,
     }
 
@@ -176,7 +220,7 @@ async def refresh_token(  # noqa: ANN201
     )
 
     return {
-        "access_token": new_access_token.token,
+        "access_token": new_access_token,
         "refresh_token": new_refresh_token.token,
     }
 
@@ -198,29 +242,73 @@ async def revoke_token(  # noqa: ANN201
     return Response()
 
 
+@router.get(
+    "/token/cache/stats",
+    response_model=TokenCacheStats,
+    dependencies=[Depends(get_current_admin_user)],
+)
+async def token_cache_stats():  # noqa: ANN201
+    return token_cache.stats()
+
+
+@router.get(
+    "/password/hasher/stats",
+    response_model=PasswordHasherStats,
+    dependencies=[Depends(get_current_admin_user)],
+)
+async def password_hasher_stats():  # noqa: ANN201
+    return password_hasher.stats()
+
+
 @router.get("/users/me", response_model=UserRead)
 async def me(current_user: User = Depends(get_current_active_user)):  # noqa: ANN201
     return current_user
 
 
-@router.get("/users", response_model=list[UserRead])
+@router.get(
+    "/users",
+    response_model=UserPage,
+    dependencies=[Depends(get_current_active_user)],
+    responses={
+        200: {"content": {"application/x-ndjson": {}}},
+        304: {"description": "Page has not been modified"},
+    },
+)
 async def users(  # noqa: ANN201
+    request: Request,
+    response: Response,
+    after: int | None = None,
+    limit: int = Query(USERS_PAGE_SIZE, ge=1, le=USERS_PAGE_MAX_SIZE),
     session: AsyncSession = Depends(get_db_session),
 ):
-    result = await session.execute(select(User))
-    return result.scalars().all()
+    # bulk consumers get all users as NDJSON without pagination
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        return StreamingResponse(
+            stream_users(after),
+            media_type="application/x-ndjson",
+        )
+
+    etag, last_modified = await get_users_page_validators(after, limit, session)
+    headers = get_validator_headers(etag, last_modified)
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    response.headers.update(headers)
+    return await get_users_page(after, limit, session)
 
 
 @router.get("/users/search", response_model=list[UserRead])
 async def search_users(  # noqa: ANN201
-    q: str,
+    q: str = Query(min_length=1, max_length=USER_SEARCH_QUERY_MAX_LENGTH),
+    prefix: bool = False,  # noqa: FBT001, FBT002
+    limit: int = Query(USER_SEARCH_LIMIT, ge=1, le=USER_SEARCH_MAX_LIMIT),
     current_user: User = Depends(get_current_active_user),
     session: AsyncSession = Depends(get_db_session),
 ):
-    query = select(User).where(
-        and_(User.username.like(f"%{q}%"), User.id != current_user.id),
-    )
-    return await session.scalars(query)
+    # results are cached for everyone, so the current user is excluded here
+    # from one extra user to still return `limit` of them
+    users = await find_users(q, prefix, limit + 1, session)
+    return [u for u in users if u.id != current_user.id][:limit]
 
 
 @router.get("/users/{user_id}", response_model=UserRead)
@@ -12,6 +12,19 @@ class TokenData(BaseModel):
     username: str
 
 
+class TokenCacheStats(BaseModel):
+    size: int
+    hits: int
+    misses: int
+
+
+class PasswordHasherStats(BaseModel):
+    workers: int
+    running: int
+    queued: int
+    rejected: int
+
+
 class UserBase(BaseModel):
     username: str
     first_name: str | None
@@ -34,6 +47,12 @@ class UserRead(UserBase):
         from_attributes = True
 
 
+class UserPage(BaseModel):
+    items: list[UserRead]
+    # pass as `after` to get the next page
+    next_cursor: int | None
+
+
 class UserUpdate(BaseModel):
     username: str | None
     first_name: str | None
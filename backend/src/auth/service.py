@@ -1,6 +1,249 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from datetime import UTC, datetime, timedelta
+from typing import Any, NamedTuple, TypeVar
+
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
+from sqlalchemy import inspect, select
+from sqlalchemy.orm import make_transient_to_detached
+
+from src.broadcast import broadcast
+from src.cache import TTLCache
+from src.chat.exceptions import BroadcastConnectionError
+from src.chat.service import Broadcast, Gap
+from src.config import (
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    PASSWORD_HASH_MAX_QUEUED,
+    PASSWORD_HASH_WORKERS,
+)
+from src.database import create_session
+
+from .constants import TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL, TOKEN_INVALIDATION_CHANNEL
+from .exceptions import PasswordHasherBusyHTTPException
+from .models import User
+
+T = TypeVar("T")
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords in a thread pool, so that bcrypt doesn't
+    block the event loop (it releases the GIL while hashing). Once `workers`
+    hashes are running and `max_queued` more are waiting, new ones are
+    rejected instead of delaying every login further.
+    """
+
+    def __init__(
+        self: "PasswordHasher",
+        context: CryptContext,
+        workers: int,
+        max_queued: int,
+    ) -> None:
+        self._context = context
+        self._workers = workers
+        self._max_queued = max_queued
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="password-hasher",
+        )
+        # submitted hashes that haven't finished, both running and queued
+        self._pending = 0
+        self._rejected = 0
+
+    async def stop(self: "PasswordHasher") -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self: "PasswordHasher", func: Callable[..., T], *args: str) -> T:
+        if self._pending >= self._workers + self._max_queued:
+            self._rejected += 1
+            raise PasswordHasherBusyHTTPException
+
+        loop = asyncio.get_running_loop()
+        future = self._executor.submit(func, *args)
+        self._pending += 1
+        # counted until the thread is done, even if the request is cancelled
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._done))
+        return await asyncio.wrap_future(future)
+
+    def _done(self: "PasswordHasher") -> None:
+        self._pending -= 1
+
+    async def hash(self: "PasswordHasher", password: str) -> str:
+        return await self._run(self._context.hash, password)
+
+    async def verify(self: "PasswordHasher", password: str, hashed: str) -> bool:
+        return await self._run(self._context.verify, password, hashed)
+
+    def stats(self: "PasswordHasher") -> dict[str, int]:
+        return {
+            "workers": self._workers,
+            "running": min(self._pending, self._workers),
+            "queued": max(self._pending - self._workers, 0),
+            "rejected": self._rejected,
+        }
+
+
+password_hasher = PasswordHasher(
+    pwd_context,
+    workers=PASSWORD_HASH_WORKERS,
+    max_queued=PASSWORD_HASH_MAX_QUEUED,
+)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/v1/token")
+
+
+class CachedToken(NamedTuple):
+    user_id: int
+    # column values of the user, so that the user is loaded without a query
+    user_state: dict[str, Any]
+    expires: datetime
+    # issue time of signed tokens, checked against revocations
+    issued_at: float | None
+
+
+class TokenCache:
+    """
+    Caches users resolved from access tokens, so that authenticated requests
+    don't query the token table. Entries of a user are evicted on all nodes
+    through the broadcast once their tokens are deleted.
+    """
+
+    def __init__(
+        self: "TokenCache",
+        broadcast: Broadcast,
+        maxsize: int,
+        ttl: float,
+    ) -> None:
+        self._broadcast = broadcast
+        # keyed by token hashes, so that tokens are not kept in memory
+        self._cache: TTLCache[str, CachedToken] = TTLCache(maxsize, ttl)
+        # user id -> timestamp before which the user's signed tokens are revoked,
+        # only revocations of tokens that haven't expired yet are kept
+        self._revoked_before: dict[int, float] = {}
+
+    async def start(self: "TokenCache") -> None:
+        await self._load_revocations()
+        self._listener_task = asyncio.create_task(self._listen())
+
+    async def stop(self: "TokenCache") -> None:
+        if self._listener_task.done():
+            self._listener_task.result()
+        else:
+            self._listener_task.cancel()
+
+    @staticmethod
+    def _get_key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self: "TokenCache", token: str) -> CachedToken | None:
+        key = self._get_key(token)
+        cached_token = self._cache.get(key)
+        # revocations are checked on hits as well, so that an entry the
+        # eviction has missed is never served
+        if (
+            cached_token is not None
+            and cached_token.issued_at is not None
+            and self.is_revoked(cached_token.user_id, cached_token.issued_at)
+        ):
+            self._cache.delete(key)
+            return None
+        return cached_token
+
+    def set(
+        self: "TokenCache",
+        token: str,
+        user: User,
+        expires: datetime,
+        issued_at: float | None = None,
+    ) -> CachedToken:
+        # users of signed tokens only have the attributes from the claims
+        loaded = inspect(user).dict
+        user_state = {
+            attr.key: loaded[attr.key]
+            for attr in inspect(User).column_attrs
+            if attr.key != "password" and attr.key in loaded
+        }
+        cached_token = CachedToken(user.id, user_state, expires, issued_at)
+        self._cache.set(self._get_key(token), cached_token)
+        return cached_token
+
+    @staticmethod
+    def get_user(cached_token: CachedToken) -> User:
+        # every request gets its own instance, which can be added to a session
+        user = User(**cached_token.user_state)
+        make_transient_to_detached(user)
+        return user
+
+    def is_revoked(self: "TokenCache", user_id: int, issued_at: float) -> bool:
+        return issued_at < self._revoked_before.get(user_id, 0)
+
+    def _revoke(self: "TokenCache", user_id: int, revoked_at: float) -> None:
+        self._cache.delete_if(lambda _, value: value.user_id == user_id)
+
+        self._revoked_before[user_id] = max(
+            revoked_at,
+            self._revoked_before.get(user_id, 0),
+        )
+        # tokens issued before that have expired on their own
+        expired_before = time.time() - ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        for revoked_user_id, revoked_before in list(self._revoked_before.items()):
+            if revoked_before < expired_before:
+                del self._revoked_before[revoked_user_id]
+
+    async def _load_revocations(self: "TokenCache") -> None:
+        expired_before = datetime.now(UTC) - timedelta(
+            minutes=ACCESS_TOKEN_EXPIRE_MINUTES,
+        )
+        async with create_session() as session:
+            revocations = await session.execute(
+                select(User.id, User.tokens_revoked_at).where(
+                    User.tokens_revoked_at > expired_before,
+                ),
+            )
+        for user_id, revoked_at in revocations:
+            self._revoke(user_id, revoked_at.timestamp())
+
+    async def invalidate_user(
+        self: "TokenCache",
+        user_id: int,
+        revoked_at: datetime,
+    ) -> None:
+        self._revoke(user_id, revoked_at.timestamp())
+        # cached entries on other nodes expire after ttl anyway, revocations
+        # are loaded from the database once they reconnect
+        with suppress(BroadcastConnectionError):
+            await self._broadcast.publish(
+                channel=TOKEN_INVALIDATION_CHANNEL,
+                message=json.dumps(
+                    {"user_id": user_id, "revoked_at": revoked_at.timestamp()},
+                ),
+            )
+
+    def stats(self: "TokenCache") -> dict[str, int]:
+        return {
+            "size": len(self._cache),
+            "hits": self._cache.hits,
+            "misses": self._cache.misses,
+        }
+
+    async def _listen(self: "TokenCache") -> None:
+        async with self._broadcast.subscribe(TOKEN_INVALIDATION_CHANNEL) as subscriber:
+            async for event in subscriber:
+                if isinstance(event, Gap):
+                    # invalidations might have been dropped
+                    self._cache.clear()
+                    await self._load_revocations()
+                    continue
+                data = json.loads(event.message)
+                self._revoke(data["user_id"], data["revoked_at"])
+
+
+token_cache = TokenCache(broadcast, maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
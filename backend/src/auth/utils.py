@@ -1,27 +1,196 @@
+import base64
+import hashlib
+import hmac
+import json
 import secrets
 import string
+import time
+from collections.abc import AsyncIterator
 from datetime import UTC, datetime, timedelta
-
-from fastapi import HTTPException, WebSocket, WebSocketDisconnect
-from sqlalchemy import delete, select
-from sqlalchemy.orm import joinedload
-
-from src.config import ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS
-from src.database import AsyncSession
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import HTTPException, Request, WebSocket, WebSocketDisconnect
+from sqlalchemy import Select, delete, func, literal, or_, select, update
+from sqlalchemy.orm import joinedload, make_transient_to_detached
+
+from src.cache import TTLCache
+from src.config import (
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    ALGORITHM,
+    REFRESH_TOKEN_EXPIRE_DAYS,
+    SECRET_KEY,
+    SIGNED_ACCESS_TOKENS,
+)
+from src.database import AsyncSession, create_session
 from src.enums import WSError
 
+from .constants import (
+    USER_SEARCH_CACHE_SIZE,
+    USER_SEARCH_CACHE_TTL,
+    USERS_STREAM_BATCH_SIZE,
+)
 from .enums import TokenType
 from .exceptions import InvalidTokenHTTPException, TokenExpiredHTTPException
 from .models import Token, User
-from .service import pwd_context
+from .schemas import UserPage, UserRead
+from .service import password_hasher, token_cache
+
+# (query, prefix, limit) -> found users
+user_search_cache: TTLCache[tuple[str, bool, int], list[UserRead]] = TTLCache(
+    maxsize=USER_SEARCH_CACHE_SIZE,
+    ttl=USER_SEARCH_CACHE_TTL,
+)
+
+
+async def find_users(
+    q: str,
+    prefix: bool,  # noqa: FBT001
+    limit: int,
+    session: AsyncSession,
+) -> list[UserRead]:
+    """
+    Finds users by username, first or last name. In prefix mode the names
+    have to start with `q`, otherwise they have to contain it or a similar
+    word. All conditions are served by the trigram GIN indexes.
+    """
+    q = q.lower()
+    key = (q, prefix, limit)
+    users = user_search_cache.get(key)
+    if users is not None:
+        return users
+
+    columns = (User.username, User.first_name, User.last_name)
+    if prefix:
+        query = (
+            select(User)
+            .where(or_(*(column.istartswith(q, autoescape=True) for column in columns)))
+            .order_by(func.length(User.username), User.username)
+        )
+    else:
+        # `<%` is true when the name has a word similar to the query
+        similarity = func.greatest(
+            *(func.word_similarity(q, column) for column in columns),
+        )
+        query = (
+            select(User)
+            .where(
+                or_(
+                    *(column.icontains(q, autoescape=True) for column in columns),
+                    *(literal(q).op("<%")(column) for column in columns),
+                ),
+            )
+            .order_by(similarity.desc(), User.username)
+        )
+
+    users = [
+        UserRead.model_validate(u) for u in await session.scalars(query.limit(limit))
+    ]
+    user_search_cache.set(key, users)
+    return users
+
+
+def get_users_query(after: int | None) -> Select:
+    query = select(User).order_by(User.id)
+    if after is not None:
+        query = query.where(User.id > after)
+    return query
+
+
+async def get_users_page(
+    after: int | None,
+    limit: int,
+    session: AsyncSession,
+) -> UserPage:
+    users = list(await session.scalars(get_users_query(after).limit(limit + 1)))
+    has_more = len(users) > limit
+    users = users[:limit]
+    return UserPage(
+        items=[UserRead.model_validate(user) for user in users],
+        next_cursor=users[-1].id if has_more else None,
+    )
+
+
+async def get_users_page_validators(
+    after: int | None,
+    limit: int,
+    session: AsyncSession,
+) -> tuple[str, datetime | None]:
+    """
+    Returns ETag and Last-Modified of the users page. Only ids and update
+    times are read, so unchanged pages are checked without loading users.
+    """
+    query = get_users_query(after).with_only_columns(User.id, User.updated_at)
+    # the extra row decides next_cursor, so it's a part of the page as well
+    rows = (await session.execute(query.limit(limit + 1))).all()
+    has_more = len(rows) > limit
+
+    digest = hashlib.blake2b(digest_size=16)
+    for user_id, updated_at in rows[:limit]:
+        digest.update(f"{user_id}:{updated_at.isoformat()};".encode())
+    digest.update(f"has_more:{has_more}".encode())
+    last_modified = max((updated_at for _, updated_at in rows), default=None)
+    return f'"{digest.hexdigest()}"', last_modified
+
+
+def get_validator_headers(etag: str, last_modified: datetime | None) -> dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(
+            last_modified.replace(tzinfo=UTC),
+            usegmt=True,
+        )
+    return headers
+
+
+def is_not_modified(
+    request: Request,
+    etag: str,
+    last_modified: datetime | None,
+) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # weak comparison, as required for If-None-Match, ignores W/ prefixes
+        etags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return etag.removeprefix("W/") in etags or "*" in etags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    # Last-Modified has a precision of seconds
+    return last_modified.replace(tzinfo=UTC, microsecond=0) <= since
+
+
+async def stream_users(after: int | None) -> AsyncIterator[str]:
+    """Yields NDJSON lines of all users with ids greater than `after`."""
+    columns = [User.__table__.c[field] for field in UserRead.model_fields]
+    while True:
+        # the request's session is closed before the response is streamed,
+        # a session per batch also doesn't hold a connection for slow clients
+        async with create_session() as session:
+            query = (
+                get_users_query(after)
+                .with_only_columns(*columns)
+                .limit(USERS_STREAM_BATCH_SIZE)
+            )
+            rows = (await session.execute(query)).mappings().all()
+
+        if rows:
+            yield "".join(json.dumps(dict(row), default=str) + "\n" for row in rows)
+        if len(rows) < USERS_STREAM_BATCH_SIZE:
+            return
+        after = rows[-1]["id"]
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.verify(plain_password, hashed_password)
 
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+async def get_password_hash(password: str) -> str:
+    return await password_hasher.hash(password)
 
 
 async def get_user(session: AsyncSession, username: str) -> User:
@@ -43,7 +212,10 @@ async def authenticate_user(
     user = await get_user(session, username)
     if not user:
         return False
-    if not verify_password(plain_password=password, hashed_password=user.password):
+    if not await verify_password(
+        plain_password=password,
+        hashed_password=user.password,
+    ):
         return False
     return user
 
@@ -53,13 +225,7 @@ async def authenticate_user_token(
     session: AsyncSession,
     websocket: WebSocket | None = None,
 ) -> User | bool:
-    access_token = await get_token(
-        token=token,
-        token_type=TokenType.ACCESS,
-        session=session,
-        websocket=websocket,
-    )
-    user = access_token.user
+    user, *_ = await get_access_token_user(token, session, websocket)
 
     if not user.is_active:
         if websocket:
@@ -104,18 +270,129 @@ async def create_token(
     return new_token
 
 
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _sign(signing_input: str) -> str:
+    signature = hmac.digest(SECRET_KEY.encode(), signing_input.encode(), "sha256")
+    return _b64encode(signature)
+
+
+def create_signed_token(
+    user: User,
+    expires: datetime | timedelta,
+    scopes: str | None = None,
+) -> str:
+    """
+    Creates a JWT signed with SECRET_KEY, which is verified without
+    querying the database. It carries the fields of the user that
+    authorization depends on, changing them requires revoking the tokens.
+    """
+    if isinstance(expires, timedelta):
+        expires = datetime.now(UTC) + expires
+    header = {"alg": ALGORITHM, "typ": "JWT"}
+    payload = {
+        "sub": str(user.id),
+        "type": TokenType.ACCESS,
+        # not truncated, so that tokens issued right after a revocation are
+        # not revoked by it
+        "iat": time.time(),
+        "exp": int(expires.timestamp()),
+        "scope": scopes if scopes else "",
+        "active": user.is_active,
+        "admin": user.is_admin,
+    }
+    signing_input = ".".join(
+        _b64encode(json.dumps(part, separators=(",", ":")).encode())
+        for part in (header, payload)
+    )
+    return f"{signing_input}.{_sign(signing_input)}"
+
+
+def is_signed_token(token: str) -> bool:
+    # random tokens consist of letters and digits only
+    return token.count(".") == 2  # noqa: PLR2004
+
+
+def _decode_signed_token(token: str) -> dict | None:
+    header_segment, _, signature = token.rpartition(".")
+    if not hmac.compare_digest(signature.encode(), _sign(header_segment).encode()):
+        return None
+    try:
+        header, payload = (
+            json.loads(_b64decode(part)) for part in header_segment.split(".")
+        )
+    except ValueError:
+        return None
+    if header.get("alg") != ALGORITHM or payload.get("type") != TokenType.ACCESS:
+        return None
+    return payload
+
+
+def verify_signed_token(
+    token: str,
+    websocket: WebSocket | None = None,
+) -> tuple[User, datetime, float]:
+    """
+    Returns the user, the expiration and the issue time of a signed access
+    token. The
+    user is built from the claims and detached, only `id`, `is_active` and
+    `is_admin` are loaded, the rest requires merging it into a session.
+    """
+    payload = _decode_signed_token(token)
+    try:
+        user = User(
+            id=int(payload["sub"]),
+            is_active=bool(payload["active"]),
+            is_admin=bool(payload["admin"]),
+        )
+        issued_at = float(payload["iat"])
+        expires = datetime.fromtimestamp(payload["exp"], UTC)
+    except (ValueError, TypeError, KeyError):
+        user = None
+
+    if user is None or token_cache.is_revoked(user.id, issued_at):
+        if websocket:
+            raise WebSocketDisconnect(
+                code=WSError.INVALID_TOKEN,
+                reason=WSError.INVALID_TOKEN.label,
+            )
+        raise InvalidTokenHTTPException
+
+    if expires <= datetime.now(UTC):
+        if websocket:
+            raise WebSocketDisconnect(
+                code=WSError.TOKEN_EXPIRED,
+                reason=WSError.TOKEN_EXPIRED.label,
+            )
+        raise TokenExpiredHTTPException
+
+    make_transient_to_detached(user)
+    return user, expires, issued_at
+
+
 async def create_access_token(
     session: AsyncSession,
     user: User,
     scopes: str | None = None,
-) -> Token:
-    return await create_token(
+) -> str:
+    expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    if SIGNED_ACCESS_TOKENS:
+        return create_signed_token(user=user, expires=expires, scopes=scopes)
+
+    access_token = await create_token(
         session=session,
         token_type=TokenType.ACCESS,
         user=user,
-        expires=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+        expires=expires,
         scopes=scopes,
     )
+    return access_token.token
 
 
 async def create_refresh_token(
@@ -171,6 +448,35 @@ async def get_token(
     return access_token
 
 
+async def get_access_token_user(
+    token: str,
+    session: AsyncSession,
+    websocket: WebSocket | None = None,
+) -> tuple[User, datetime, float | None]:
+    """
+    Returns the user, the expiration and the issue time of an access token,
+    both signed tokens and ones stored in the database are accepted. Signed
+    tokens are resolved without a query, see `verify_signed_token`. Tokens
+    stored in the database have no issue time, they are deleted on revocation.
+    """
+    if not is_signed_token(token):
+        access_token = await get_token(
+            token=token,
+            token_type=TokenType.ACCESS,
+            session=session,
+            websocket=websocket,
+        )
+        return access_token.user, access_token.expires, None
+
+    return verify_signed_token(token, websocket)
+
+
 async def delete_user_tokens(session: AsyncSession, user: User) -> None:
+    # also revokes signed access tokens issued before now
+    revoked_at = datetime.now(UTC)
+    await session.execute(
+        update(User).where(User.id == user.id).values(tokens_revoked_at=revoked_at),
+    )
     await session.execute(delete(Token).where(Token.user_id == user.id))
     await session.commit()
+    await token_cache.invalidate_user(user.id, revoked_at)
@@ -0,0 +1,15 @@
+from .chat.service import Broadcast
+from .config import (
+    BROADCAST_BACKEND_OPTIONS,
+    BROADCAST_OVERFLOW_POLICY,
+    BROADCAST_QUEUE_SIZE,
+    BROADCAST_URL,
+)
+
+# shared by all routers of the node, connected for the application's lifetime
+broadcast = Broadcast(
+    BROADCAST_URL,
+    queue_size=BROADCAST_QUEUE_SIZE,
+    overflow_policy=BROADCAST_OVERFLOW_POLICY,
+    backend_options=BROADCAST_BACKEND_OPTIONS,
+)
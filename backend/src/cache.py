@@ -0,0 +1,53 @@
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Generic, TypeVar
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class TTLCache(Generic[K, V]):
+    """
+    In-process cache for values that may be slightly stale. Entries expire
+    `ttl` seconds after they are set, the least recently used ones are
+    evicted once there are more than `maxsize` of them.
+    """
+
+    def __init__(self: "TTLCache", maxsize: int, ttl: float) -> None:
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._entries: OrderedDict[K, tuple[float, V]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self: "TTLCache") -> int:
+        return len(self._entries)
+
+    def get(self: "TTLCache", key: K) -> V | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self: "TTLCache", key: K, value: V) -> None:
+        self._entries[key] = (time.monotonic() + self._ttl, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def delete(self: "TTLCache", key: K) -> None:
+        self._entries.pop(key, None)
+
+    def delete_if(self: "TTLCache", predicate: Callable[[K, V], bool]) -> None:
+        for key in [k for k, (_, v) in self._entries.items() if predicate(k, v)]:
+            del self._entries[key]
+
+    def clear(self: "TTLCache") -> None:
+        self._entries.clear()
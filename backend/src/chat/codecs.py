@@ -0,0 +1,79 @@
+import json
+from abc import ABC, abstractmethod
+from typing import Any
+
+import msgpack
+from fastapi import WebSocket
+
+
+class Codec(ABC):
+    """
+    Encoding of the chat websocket frames, selected by the subprotocol the
+    client asks for. Events are published as JSON, so frames are converted
+    from it once per event and codec, however many websockets they're sent to.
+    """
+
+    subprotocol: str
+
+    @abstractmethod
+    def encode(self: "Codec", data: Any) -> str | bytes:  # noqa: ANN401
+        pass
+
+    @abstractmethod
+    def decode(self: "Codec", frame: bytes) -> Any:  # noqa: ANN401
+        """Decodes a binary frame, text frames are always JSON."""
+
+    def transcode(self: "Codec", frame: str) -> str | bytes:
+        """Converts a JSON frame to this encoding."""
+        return self.encode(json.loads(frame))
+
+    async def send(self: "Codec", websocket: WebSocket, frame: str | bytes) -> None:
+        if isinstance(frame, bytes):
+            await websocket.send_bytes(frame)
+        else:
+            await websocket.send_text(frame)
+
+
+class JSONCodec(Codec):
+    subprotocol = "webchat.json"
+
+    def encode(self: "JSONCodec", data: Any) -> str:  # noqa: ANN401
+        return json.dumps(data, default=str)
+
+    def decode(self: "JSONCodec", frame: bytes) -> bytes:
+        # binary frames carry uploaded files as is
+        return frame
+
+    def transcode(self: "JSONCodec", frame: str) -> str:
+        return frame
+
+
+class MsgPackCodec(Codec):
+    """
+    Sends and receives MessagePack in binary frames. Uploaded files are sent
+    as frames holding a single bin object instead of raw bytes.
+    """
+
+    subprotocol = "webchat.msgpack"
+
+    def encode(self: "MsgPackCodec", data: Any) -> bytes:  # noqa: ANN401
+        return msgpack.packb(data, default=str)
+
+    def decode(self: "MsgPackCodec", frame: bytes) -> Any:  # noqa: ANN401
+        return msgpack.unpackb(frame)
+
+
+json_codec = JSONCodec()
+
+CODECS = {codec.subprotocol: codec for codec in (json_codec, MsgPackCodec())}
+
+
+def negotiate_codec(subprotocols: list[str]) -> Codec:
+    """
+    Returns the codec of the first supported subprotocol the client asks
+    for, JSON is used by default.
+    """
+    for subprotocol in subprotocols:
+        if subprotocol in CODECS:
+            return CODECS[subprotocol]
+    return json_codec
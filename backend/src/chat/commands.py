@@ -0,0 +1,146 @@
+"""
+Maintenance commands for chats.
+
+Run from the backend directory:
+
+    python -m src.chat.commands rebuild-summaries [--chat-id ID ...]
+    python -m src.chat.commands detach-partitions --before YYYY-MM-DD [--drop]
+"""
+
+import argparse
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import func, literal_column, select, text, true
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from src.database import AsyncSession, create_session, engine
+
+from .models import Chat, ChatSummary, Message
+from .utils import get_message_partitions
+
+
+async def rebuild_summaries(
+    session: AsyncSession,
+    chat_ids: list[int] | None = None,
+) -> int:
+    """
+    Recomputes chat summaries from the messages. Messages written while
+    the rebuild runs may be missing from the counts, so it should be done
+    when chats are not written to, e.g. after a backfill or a restore.
+    """
+    last_message = (
+        select(Message.id, Message.created_at, Message.author_id)
+        .where(Message.chat_id == Chat.id)
+        .order_by(Message.id.desc())
+        .limit(1)
+        .lateral()
+    )
+    message_count = (
+        select(func.count().label("count")).where(Message.chat_id == Chat.id).lateral()
+    )
+    summaries = (
+        select(
+            Chat.id,
+            last_message.c.id,
+            last_message.c.created_at,
+            last_message.c.author_id,
+            message_count.c.count,
+            func.coalesce(last_message.c.created_at, Chat.created_at),
+        )
+        .select_from(Chat)
+        .outerjoin(last_message, true())
+        .join(message_count, true())
+    )
+    if chat_ids:
+        summaries = summaries.where(Chat.id.in_(chat_ids))
+
+    columns = [
+        "chat_id",
+        "last_message_id",
+        "last_message_at",
+        "last_author_id",
+        "message_count",
+        "last_activity_at",
+    ]
+    query = pg_insert(ChatSummary).from_select(columns, summaries)
+    query = query.on_conflict_do_update(
+        index_elements=[ChatSummary.chat_id],
+        set_={column: query.excluded[column] for column in columns[1:]},
+    ).returning(literal_column("1"))
+
+    rebuilt = len((await session.execute(query)).all())
+    await session.commit()
+    return rebuilt
+
+
+async def detach_partitions(before: datetime, drop: bool) -> list[str]:  # noqa: FBT001
+    """
+    Detaches partitions of messages created before `before` from the message
+    table. Detached partitions are kept as tables named message_pYYYY_MM, so
+    that they can be archived, e.g. with pg_dump --table, unless `drop` is set.
+    Chat summaries may still refer to the detached messages.
+    """
+    async with create_session() as session:
+        partitions = [
+            partition.name
+            for partition in await get_message_partitions(session)
+            if partition.upper <= before
+        ]
+
+    # detaching concurrently doesn't block the message table,
+    # but can't be done in a transaction
+    autocommit_engine = engine.execution_options(isolation_level="AUTOCOMMIT")
+    async with autocommit_engine.connect() as connection:
+        for name in partitions:
+            await connection.execute(
+                text(f"ALTER TABLE message DETACH PARTITION {name} CONCURRENTLY"),
+            )
+            if drop:
+                await connection.execute(text(f"DROP TABLE {name}"))
+    return partitions
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild_parser = subparsers.add_parser(
+        "rebuild-summaries",
+        help="recompute chat summaries from the messages",
+    )
+    rebuild_parser.add_argument(
+        "--chat-id",
+        type=int,
+        action="append",
+        dest="chat_ids",
+        help="chat to rebuild, all chats by default",
+    )
+    detach_parser = subparsers.add_parser(
+        "detach-partitions",
+        help="detach partitions of old messages from the message table",
+    )
+    detach_parser.add_argument(
+        "--before",
+        type=datetime.fromisoformat,
+        required=True,
+        help="detach partitions of messages created before this date",
+    )
+    detach_parser.add_argument(
+        "--drop",
+        action="store_true",
+        help="drop the detached partitions instead of keeping them for archiving",
+    )
+    args = parser.parse_args()
+
+    if args.command == "rebuild-summaries":
+        async with create_session() as session:
+            rebuilt = await rebuild_summaries(session, args.chat_ids)
+        print(f"Rebuilt {rebuilt} chat summaries")  # noqa: T201
+    elif args.command == "detach-partitions":
+        detached = await detach_partitions(args.before, args.drop)
+        action = "Dropped" if args.drop else "Detached"
+        print(f"{action} partitions: {', '.join(detached) or 'none'}")  # noqa: T201
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
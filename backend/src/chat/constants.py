@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+from .enums import ChatType
+
+# broadcast channel name prefixes, e.g. "chat:42" or "user:7"
+CHAT_CHANNEL_PREFIX = "chat"
+USER_CHANNEL_PREFIX = "user"
+
+# Postgres rejects NOTIFY payloads of that many bytes or more
+NOTIFY_MAX_PAYLOAD_SIZE = 8000
+
+# delays between attempts to restore a lost broadcast connection, in seconds
+RECONNECT_MIN_DELAY = 0.1
+RECONNECT_MAX_DELAY = 10
+
+# max number of events replayed to a reconnecting websocket per chat
+RESUME_MAX_EVENTS = 500
+# stream ids come from the Redis clock and creation dates from the Postgres one,
+# messages that far before the last received event are replayed as well
+RESUME_CLOCK_MARGIN = timedelta(seconds=5)
+
+# errors returned when a chat with the same unique key already exists
+DUPLICATE_CHAT_DETAILS = {
+    ChatType.SAVED_MESSAGES: (
+        "There is already Saved messages chat created for this user."
+    ),
+    ChatType.DIALOGUE: "There is already a dialogue created with this user.",
+}
+
+# number of messages returned per page of chat history by default and at most
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_PAGE_MAX_SIZE = 200
+
+# number of chats returned per inbox page by default and at most
+INBOX_PAGE_SIZE = 50
+INBOX_PAGE_MAX_SIZE = 200
+
+# the message table is partitioned by month of creation, partitions are
+# created that many months ahead and checked for every interval seconds
+MESSAGE_PARTITION_MONTHS_AHEAD = 3
+MESSAGE_PARTITION_CHECK_INTERVAL = 6 * 60 * 60
+# advisory lock held while partitions are created, so that nodes don't race
+MESSAGE_PARTITION_LOCK_ID = 7_202_310
+
+# uploads not written to for that many seconds can't be resumed and are removed,
+# stale ones are looked for every interval seconds
+UPLOAD_MAX_AGE = 24 * 60 * 60
+UPLOAD_SWEEP_INTERVAL = 60 * 60
+
+# number of messages fetched from the export cursor at once
+EXPORT_BATCH_SIZE = 1000
+
+# text search configuration of message search vectors, "simple" does not stem
+# words, so that search works the same for all languages
+SEARCH_CONFIG = "simple"
+# private use characters mark the matches in snippets before they are escaped
+SEARCH_HIGHLIGHT_START = "\ue000"
+SEARCH_HIGHLIGHT_STOP = "\ue001"
+SEARCH_HEADLINE_OPTIONS = (
+    f"StartSel={SEARCH_HIGHLIGHT_START}, StopSel={SEARCH_HIGHLIGHT_STOP}, "
+    "MaxWords=20, MinWords=5, MaxFragments=2"
+)
+# number of search results returned per page by default and at most
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_MAX_SIZE = 100
+SEARCH_QUERY_MAX_LENGTH = 256
+# only that many most recent matches are ranked, older ones are not returned
+SEARCH_MAX_CANDIDATES = 1000
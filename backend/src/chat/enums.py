@@ -17,6 +17,9 @@ class WSMessageType(StrEnum):
     AUTHENTICATION = "authentication"
     NOTIFICATION = "notification"
     MESSAGE = "message"
+    RESUME = "resume"
+    READ = "read"
+    UPLOAD = "upload"
 
 
 class WSNotificationType(StrEnum):
@@ -24,3 +27,12 @@ class WSNotificationType(StrEnum):
     USER_STOPPED_TYPING = "user_stopped_typing"
     USER_ONLINE = "user_online"
     USER_OFFLINE = "user_offline"
+    CHAT_CREATED = "chat_created"
+    CHAT_DELETED = "chat_deleted"
+    GAP = "gap"  # some events were dropped, client should resync
+
+
+class OverflowPolicy(StrEnum):
+    DROP_OLDEST = "drop_oldest"
+    GAP = "gap"
+    DISCONNECT = "disconnect"
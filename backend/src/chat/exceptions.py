@@ -9,5 +9,21 @@ class ChatCreationHTTPException(HTTPException):
         )
 
 
+class InvalidCursorHTTPException(HTTPException):
+    def __init__(self: "InvalidCursorHTTPException") -> None:
+        super().__init__(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor",
+        )
+
+
 class UnsubscribedError(Exception):
     pass
+
+
+class BroadcastConnectionError(Exception):
+    pass
+
+
+class MessageTooLargeError(Exception):
+    pass
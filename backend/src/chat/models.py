@@ -1,8 +1,10 @@
+from datetime import datetime
 from typing import TYPE_CHECKING
 
-from sqlalchemy import ForeignKey, String, Text
-from sqlalchemy.dialects.postgresql import ENUM
+from sqlalchemy import Computed, ForeignKey, Index, String, Text
+from sqlalchemy.dialects.postgresql import ENUM, TSVECTOR
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.sql import func
 
 from src.database import Base
 from src.models import CreatedAtMixin, IdMixin
@@ -16,16 +18,23 @@ if TYPE_CHECKING:
 
 class Chat(IdMixin, CreatedAtMixin, Base):
     __tablename__ = "chat"
+    __table_args__ = (
+        # rejects duplicate dialogues and saved messages chats, even concurrent ones
+        Index("ix_chat_unique_key", "unique_key", unique=True),
+    )
 
     name: Mapped[str] = mapped_column(String(128))
     type: Mapped[ChatType] = mapped_column(ENUM(ChatType, name="chat_type"))
     image_url: Mapped[str]
+    # e.g. "dialogue:3:7" or "saved_messages:3", see get_chat_unique_key
+    unique_key: Mapped[str | None] = mapped_column(String(64), default=None)
 
     messages: Mapped[list["Message"]] = relationship("Message", back_populates="chat")
     participants: Mapped[list["ChatParticipant"]] = relationship(
         "ChatParticipant",
         back_populates="chat",
     )
+    summary: Mapped["ChatSummary"] = relationship("ChatSummary")
 
     def add_participants(self: "Chat", participants: list[ParticipantCreate]) -> None:
         for participant in participants:
@@ -37,8 +46,39 @@ class Chat(IdMixin, CreatedAtMixin, Base):
             )
 
 
+class ChatSummary(Base):
+    """
+    Projection of the chat's messages, updated by the message writer
+    in the same transaction as the messages are inserted.
+    """
+
+    __tablename__ = "chat_summary"
+    __table_args__ = (
+        # inbox ordering and "chats with activity since" sync
+        Index("ix_chat_summary_last_activity_at", "last_activity_at", "chat_id"),
+    )
+
+    chat_id: Mapped[int] = mapped_column(
+        ForeignKey("chat.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    last_message_id: Mapped[int | None] = mapped_column(default=None)
+    last_message_at: Mapped[datetime | None] = mapped_column(default=None)
+    last_author_id: Mapped[int | None] = mapped_column(
+        ForeignKey("user.id", ondelete="SET NULL"),
+        default=None,
+    )
+    message_count: Mapped[int] = mapped_column(default=0, server_default="0")
+    # time of the last message or of the chat creation if there are none
+    last_activity_at: Mapped[datetime] = mapped_column(server_default=func.now())
+
+
 class ChatParticipant(CreatedAtMixin, Base):
     __tablename__ = "chat_participant"
+    __table_args__ = (
+        # the primary key starts with chat_id, chats of a user are looked up by this
+        Index("ix_chat_participant_participant_id", "participant_id"),
+    )
 
     chat_id: Mapped[int] = mapped_column(
         ForeignKey("chat.id", ondelete="CASCADE"),
@@ -49,6 +89,10 @@ class ChatParticipant(CreatedAtMixin, Base):
         primary_key=True,
     )
     is_admin: Mapped[bool] = mapped_column(default=False)
+    # id of the last message read by the participant, messages after it are unread
+    last_read_message_id: Mapped[int | None] = mapped_column(default=None)
+    # kept up to date by the message writer, so that badges are not counted
+    unread_count: Mapped[int] = mapped_column(default=0, server_default="0")
 
     chat: Mapped["Chat"] = relationship("Chat", back_populates="participants")
     participant: Mapped["User"] = relationship("User", back_populates="chats")
@@ -56,14 +100,33 @@ class ChatParticipant(CreatedAtMixin, Base):
 
 class Message(IdMixin, CreatedAtMixin, Base):
     __tablename__ = "message"
+    __table_args__ = (
+        # chat history is paginated by (created_at, id) keyset
+        Index("ix_message_chat_id_created_at_id", "chat_id", "created_at", "id"),
+        Index("ix_message_search_vector", "search_vector", postgresql_using="gin"),
+        # monthly partitions are created by MessagePartitionMaintainer
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
+    # the partition key has to be a part of the primary key, queries by id
+    # should filter by created_at as well, so that partitions are pruned
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    created_at: Mapped[datetime] = mapped_column(
+        primary_key=True,
+        server_default=func.now(),
+    )
     author_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
     sender_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
     chat_id: Mapped[int] = mapped_column(ForeignKey("chat.id", ondelete="CASCADE"))
     type: Mapped[MessageType] = mapped_column(ENUM(MessageType, name="message_type"))
     content: Mapped[str] = mapped_column(Text)
-    is_read: Mapped[bool] = mapped_column(default=False)
     is_edited: Mapped[bool] = mapped_column(default=False)
+    # only used in queries, so it's not loaded with messages
+    search_vector: Mapped[str] = mapped_column(
+        TSVECTOR,
+        Computed("to_tsvector('simple', content)", persisted=True),
+        deferred=True,
+    )
 
     author: Mapped["User"] = relationship("User", foreign_keys=[author_id])
     sender: Mapped["User"] = relationship("User", foreign_keys=[sender_id])
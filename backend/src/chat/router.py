@@ -1,149 +1,599 @@
+import asyncio
 import json
+from contextlib import suppress
 from datetime import UTC, datetime
+from typing import Any
 
 from anyio import create_task_group
 from fastapi import (
     APIRouter,
     Depends,
     HTTPException,
+    Query,
+    Request,
     Response,
     WebSocket,
     WebSocketDisconnect,
     status,
 )
+from fastapi.responses import StreamingResponse
 from fastapi.websockets import WebSocketState
 from pydantic import ValidationError
-from sqlalchemy import delete, func, select
-from sqlalchemy.orm import contains_eager, joinedload
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
-from src.auth.dependencies import get_current_active_user
+from src.auth.dependencies import get_current_active_user, get_current_admin_user
 from src.auth.models import User
 from src.auth.utils import authenticate_user_token
-from src.config import REDIS_URL
-from src.database import AsyncSession, get_db_session
+from src.broadcast import broadcast
+from src.config import (
+    MESSAGE_BATCH_SIZE,
+    MESSAGE_BATCH_WINDOW,
+    READ_RECEIPT_WINDOW,
+)
+from src.database import AsyncSession, create_session, get_db_session
 from src.enums import WSError
-
-from .enums import ChatType, WSMessageType
-from .exceptions import ChatCreationHTTPException
-from .models import Chat, ChatParticipant, Message
+from src.responses import RangeFileResponse, accepts_encoding
+from src.storage import blob_store
+
+from .codecs import Codec, negotiate_codec
+from .constants import (
+    DUPLICATE_CHAT_DETAILS,
+    INBOX_PAGE_MAX_SIZE,
+    INBOX_PAGE_SIZE,
+    MESSAGE_PARTITION_CHECK_INTERVAL,
+    MESSAGE_PARTITION_MONTHS_AHEAD,
+    MESSAGES_PAGE_MAX_SIZE,
+    MESSAGES_PAGE_SIZE,
+    RECONNECT_MAX_DELAY,
+    RECONNECT_MIN_DELAY,
+    RESUME_CLOCK_MARGIN,
+    RESUME_MAX_EVENTS,
+    SEARCH_PAGE_MAX_SIZE,
+    SEARCH_PAGE_SIZE,
+    SEARCH_QUERY_MAX_LENGTH,
+    UPLOAD_MAX_AGE,
+    UPLOAD_SWEEP_INTERVAL,
+)
+from .enums import ChatType, MessageType, WSMessageType, WSNotificationType
+from .exceptions import (
+    BroadcastConnectionError,
+    ChatCreationHTTPException,
+    MessageTooLargeError,
+)
+from .models import Chat, ChatParticipant, ChatSummary, Message
 from .schemas import (
+    BroadcastStats,
     ChatCreate,
     ChatRead,
     CreateChatResponse,
-    MessageRead,
+    FileContent,
+    InboxPage,
+    MessagePage,
+    MessageSearchPage,
     ParticipantCreate,
+    ReadCreate,
+    ReadStateRead,
     WSAuthMessage,
     WSMessage,
+    WSReadBody,
+    WSResumeBody,
+    WSUploadBody,
+)
+from .service import (
+    ChatConnection,
+    Gap,
+    MessagePartitionMaintainer,
+    MessageWriter,
+    ReadReceiptCoalescer,
+    UploadSweeper,
+)
+from .utils import (
+    chat_unique_key_exists,
+    check_chat_participants,
+    create_message,
+    encode_cursor,
+    encode_event,
+    get_chat_channel,
+    get_chat_unique_key,
+    get_inbox_page,
+    get_messages_page,
+    get_messages_since,
+    get_unread_counts,
+    get_user_channel,
+    get_user_chat_ids,
+    is_chat_participant,
+    mark_read,
+    search_messages,
+    send_error,
+    stream_chat_export,
 )
-from .service import Broadcast
-from .utils import create_message, send_error
 
-broadcast = Broadcast(REDIS_URL)
+message_writer = MessageWriter(
+    batch_size=MESSAGE_BATCH_SIZE,
+    batch_window=MESSAGE_BATCH_WINDOW,
+)
+
+read_receipts = ReadReceiptCoalescer(broadcast, window=READ_RECEIPT_WINDOW)
+
+message_partitions = MessagePartitionMaintainer(
+    months_ahead=MESSAGE_PARTITION_MONTHS_AHEAD,
+    interval=MESSAGE_PARTITION_CHECK_INTERVAL,
+)
+
+upload_sweeper = UploadSweeper(
+    blob_store,
+    max_age=UPLOAD_MAX_AGE,
+    interval=UPLOAD_SWEEP_INTERVAL,
+)
+
+# membership changes being published again after a failure
+pending_publishes: set[asyncio.Task] = set()
 
 router = APIRouter(
     prefix="/api/v1",
     tags=["chat"],
-    on_startup=[broadcast.connect],
-    on_shutdown=[broadcast.disconnect],
+    on_startup=[
+        message_partitions.start,
+        message_writer.start,
+        read_receipts.start,
+        upload_sweeper.start,
+    ],
+    on_shutdown=[
+        upload_sweeper.stop,
+        read_receipts.stop,
+        message_writer.stop,
+        message_partitions.stop,
+    ],
 )
 
 
-async def message_receiver(
-    websocket: WebSocket,
-    user: User,
-    session: AsyncSession,
+async def publish_membership_change(
+    chat_id: int,
+    participant_ids: list[int],
+    notification_type: WSNotificationType,
 ) -> None:
-    while websocket.client_state == WebSocketState.CONNECTED:
-        message = await websocket.receive()
-        if message["type"] == "websocket.disconnect":
-            raise WebSocketDisconnect(message["code"], message.get("reason"))
-        msg_type = None
-        data = {}
-
-        if message["text"]:
-            data = json.loads(message["text"])
-            try:
-                message_data = WSMessage(**data)
-
-                match message_data.type:
-                    case WSMessageType.NOTIFICATION:
-                        msg_type = WSMessageType.NOTIFICATION.value
-                    case WSMessageType.MESSAGE:
-                        msg_type = WSMessageType.MESSAGE.value
-
-                        new_message = await create_message(
-                            message_data.model_dump()["body"],
-                            user,
-                            session,
-                        )
-                        data = new_message.model_dump()
-            except ValidationError as e:
-                await send_error(websocket, e.json())
-                continue
-            except HTTPException as e:
-                await send_error(websocket, str(e))
-                continue
-        elif message["bytes"]:
-            # TODO: process uploaded files
-            pass
+    # let participants' open websockets (un)subscribe from the chat channel
+    for participant_id in participant_ids:
+        body = {
+            "type": notification_type.value,
+            "user_id": participant_id,
+            "chat_id": chat_id,
+        }
+        channel = get_user_channel(participant_id)
+        message = encode_event(WSMessageType.NOTIFICATION, body)
+        try:
+            await broadcast.publish(channel=channel, message=message)
+        except BroadcastConnectionError:
+            # websockets trust their membership cache, so the change must
+            # not be lost, it's delivered in the background instead
+            task = asyncio.create_task(publish_with_retries(channel, message))
+            pending_publishes.add(task)
+            task.add_done_callback(pending_publishes.discard)
+
+
+async def publish_with_retries(channel: str, message: str) -> None:
+    delay = RECONNECT_MIN_DELAY
+    while True:
+        await asyncio.sleep(delay)
+        try:
+            await broadcast.publish(channel=channel, message=message)
+        except BroadcastConnectionError:
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        else:
+            return
+
+
+async def publish_event(
+    connection: ChatConnection,
+    channel: str,
+    msg_type: WSMessageType,
+    body: dict,
+) -> None:
+    # the frame is encoded once here and sent to all subscribers as is
+    try:
+        await broadcast.publish(
+            channel=channel,
+            message=encode_event(msg_type, body),
+        )
+    except BroadcastConnectionError:
+        await send_error(
+            connection.websocket,
+            "Broadcast is temporarily unavailable",
+            connection.codec,
+        )
+    except MessageTooLargeError:
+        # a written message is still returned by the chat history
+        await send_error(
+            connection.websocket,
+            "Message is too large to be broadcast",
+            connection.codec,
+        )
+
+
+async def send_event(
+    connection: ChatConnection,
+    msg_type: WSMessageType,
+    body: dict,
+) -> None:
+    codec = connection.codec
+    await codec.send(
+        connection.websocket,
+        codec.encode({"type": msg_type.value, "body": body}),
+    )
+
+
+async def receive_frame(websocket: WebSocket, codec: Codec) -> Any:  # noqa: ANN401
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message["code"], message.get("reason"))
+
+    if message.get("text") is not None:
+        return json.loads(message["text"])
+    return codec.decode(message["bytes"])
+
+
+async def join_chat(connection: ChatConnection, chat_id: int) -> None:
+    connection.chat_ids.add(chat_id)
+    await broadcast.add_channel(connection.subscriber, get_chat_channel(chat_id))
+
+
+async def leave_chat(connection: ChatConnection, chat_id: int) -> None:
+    connection.chat_ids.discard(chat_id)
+    await broadcast.remove_channel(connection.subscriber, get_chat_channel(chat_id))
+
+
+async def sync_chats(connection: ChatConnection) -> None:
+    """Reloads the chats user participates in, e.g. after events were missed."""
+    async with create_session() as session:
+        chat_ids = await get_user_chat_ids(connection.user, session)
+    for chat_id in connection.chat_ids - chat_ids:
+        await leave_chat(connection, chat_id)
+    for chat_id in chat_ids - connection.chat_ids:
+        await join_chat(connection, chat_id)
+
+
+async def check_participant(connection: ChatConnection, chat_id: int) -> None:
+    """
+    Makes sure user still participates in the chat before operations that
+    are rare but costly enough to not rely on the membership cache alone.
+    """
+    if chat_id in connection.chat_ids:
+        async with create_session() as session:
+            if await is_chat_participant(chat_id, connection.user.id, session):
+                return
+        await leave_chat(connection, chat_id)
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+
+async def write_message(connection: ChatConnection, message: dict) -> None:
+    try:
+        new_message = await create_message(
+            message,
+            connection.user,
+            connection.chat_ids,
+            message_writer,
+        )
+    except HTTPException:
+        # the chat has been deleted or left in the meantime
+        await leave_chat(connection, message["chat_id"])
+        raise
+    await publish_event(
+        connection,
+        get_chat_channel(new_message.chat_id),
+        WSMessageType.MESSAGE,
+        new_message.model_dump(),
+    )
 
-        data = {
-            "type": msg_type,
-            "body": data,
+
+async def resume_chat(connection: ChatConnection, body: WSResumeBody) -> None:
+    if body.chat_id not in connection.chat_ids:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    events = await broadcast.history(
+        get_chat_channel(body.chat_id),
+        body.last_event_id,
+        RESUME_MAX_EVENTS,
+    )
+    if events is not None:
+        for event in events:
+            await connection.codec.send(
+                connection.websocket,
+                event.get_frame(connection.codec),
+            )
+        return
+
+    # missed events are no longer retained, replay messages from the database
+    milliseconds = int(body.last_event_id.split("-")[0])
+    since = datetime.fromtimestamp(milliseconds / 1000, UTC).replace(tzinfo=None)
+    async with create_session() as session:
+        messages = await get_messages_since(
+            body.chat_id,
+            since - RESUME_CLOCK_MARGIN,
+            body.last_message_id,
+            RESUME_MAX_EVENTS + 1,
+            session,
+        )
+    for message in messages[:RESUME_MAX_EVENTS]:
+        await send_event(connection, WSMessageType.MESSAGE, message.model_dump())
+
+    if len(messages) > RESUME_MAX_EVENTS:
+        # too many were missed, the rest has to be fetched page by page
+        last = messages[RESUME_MAX_EVENTS - 1]
+        gap_body = {
+            "type": WSNotificationType.GAP.value,
+            "user_id": connection.user.id,
+            "chat_id": body.chat_id,
+            # pass as `after` to GET /chats/{chat_id}/messages
+            "after": encode_cursor(last.created_at, last.id),
         }
+        await send_event(connection, WSMessageType.NOTIFICATION, gap_body)
 
-        await broadcast.publish(
-            channel="chatroom",
-            message=json.dumps(data, default=str),
+
+async def read_chat(connection: ChatConnection, body: WSReadBody) -> None:
+    if body.chat_id not in connection.chat_ids:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    async with create_session() as session:
+        read_state = await mark_read(
+            body.chat_id,
+            connection.user.id,
+            body.message_id,
+            session,
+        )
+    if read_state:
+        read_receipts.add(body.chat_id, connection.user.id, body.message_id)
+
+
+async def start_upload(connection: ChatConnection, body: WSUploadBody) -> None:
+    await check_participant(connection, body.chat_id)
+
+    # an unfinished upload can still be resumed later
+    if connection.upload is not None:
+        await connection.upload.close()
+        connection.upload = connection.upload_body = None
+
+    try:
+        upload = await blob_store.open_upload(connection.user.id, body.upload_id)
+    except FileNotFoundError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Upload not found",
+        ) from e
+    if upload.received > body.size:
+        await blob_store.abort(upload)
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Upload is larger than the specified size",
+        )
+
+    connection.upload, connection.upload_body = upload, body
+    await send_event(
+        connection,
+        WSMessageType.UPLOAD,
+        {"upload_id": upload.id, "offset": upload.received},
+    )
+    # the connection might have been lost after the last chunk
+    if upload.received == body.size:
+        await finish_upload(connection)
+
+
+async def finish_upload(connection: ChatConnection) -> None:
+    upload, body = connection.upload, connection.upload_body
+    connection.upload = connection.upload_body = None
+
+    digest = await blob_store.finish(upload)
+    content = FileContent(hash=digest, name=body.name, size=body.size)
+    await write_message(
+        connection,
+        {
+            "chat_id": body.chat_id,
+            "type": body.type,
+            "content": content.model_dump_json(),
+        },
+    )
+
+
+async def process_bytes_message(connection: ChatConnection, data: bytes) -> None:
+    upload, body = connection.upload, connection.upload_body
+    try:
+        if upload is None:
+            raise HTTPException(  # noqa: TRY301
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="No upload has been started",
+            )
+        if upload.received + len(data) > body.size:
+            connection.upload = connection.upload_body = None
+            await blob_store.abort(upload)
+            raise HTTPException(  # noqa: TRY301
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Upload is larger than the specified size",
+            )
+
+        # written as it's received, so that files are never kept in memory
+        await upload.write(data)
+        if upload.received == body.size:
+            await finish_upload(connection)
+    except HTTPException as e:
+        await send_error(connection.websocket, str(e), connection.codec)
+    except BroadcastConnectionError:
+        await send_error(
+            connection.websocket,
+            "Broadcast is temporarily unavailable",
+            connection.codec,
+        )
+    except OSError:
+        # e.g. the disk is full, the part written so far can be resumed
+        if connection.upload is not None:
+            with suppress(OSError):
+                await connection.upload.close()
+            connection.upload = connection.upload_body = None
+        await send_error(
+            connection.websocket,
+            f"Upload {upload.id} failed, it can be resumed later",
+            connection.codec,
         )
 
 
-async def message_sender(websocket: WebSocket) -> None:
-    async with broadcast.subscribe(channel="chatroom") as subscriber:
-        async for event in subscriber:
-            await websocket.send_json(event.message)
+async def process_message(connection: ChatConnection, data: Any) -> None:  # noqa: ANN401
+    websocket, codec = connection.websocket, connection.codec
+    try:
+        message_data = WSMessage.model_validate(data).root
+
+        match message_data.type:
+            case WSMessageType.NOTIFICATION:
+                if message_data.body.chat_id not in connection.chat_ids:
+                    raise HTTPException(  # noqa: TRY301
+                        status_code=status.HTTP_404_NOT_FOUND,
+                    )
+                await publish_event(
+                    connection,
+                    get_chat_channel(message_data.body.chat_id),
+                    WSMessageType.NOTIFICATION,
+                    message_data.body.model_dump(),
+                )
+            case WSMessageType.MESSAGE:
+                await write_message(connection, message_data.model_dump()["body"])
+            case WSMessageType.RESUME:
+                await resume_chat(connection, message_data.body)
+            case WSMessageType.READ:
+                await read_chat(connection, message_data.body)
+            case WSMessageType.UPLOAD:
+                await start_upload(connection, message_data.body)
+    except ValidationError as e:
+        await send_error(websocket, e.json(), codec)
+    except HTTPException as e:
+        await send_error(websocket, str(e), codec)
+    except BroadcastConnectionError:
+        await send_error(websocket, "Broadcast is temporarily unavailable", codec)
+
+
+async def message_receiver(connection: ChatConnection) -> None:
+    websocket = connection.websocket
+    try:
+        while websocket.client_state == WebSocketState.CONNECTED:
+            try:
+                data = await receive_frame(websocket, connection.codec)
+            except ValueError:
+                await send_error(websocket, "Frame can't be decoded", connection.codec)
+                continue
+
+            # uploaded files are received in binary frames
+            if isinstance(data, bytes):
+                await process_bytes_message(connection, data)
+            else:
+                await process_message(connection, data)
+    finally:
+        # the received part is kept, so that the upload can be resumed,
+        # it's removed by the sweeper unless resumed in time
+        if connection.upload is not None:
+            with suppress(OSError):
+                if connection.upload.received:
+                    await connection.upload.close()
+                else:
+                    await blob_store.abort(connection.upload)
+
+
+async def message_sender(connection: ChatConnection) -> None:
+    websocket = connection.websocket
+    user_channel = get_user_channel(connection.user.id)
+
+    async for event in connection.subscriber:
+        if isinstance(event, Gap):
+            # membership changes might have been missed as well
+            await sync_chats(connection)
+            body = {
+                "type": WSNotificationType.GAP.value,
+                "user_id": connection.user.id,
+            }
+            await send_event(connection, WSMessageType.NOTIFICATION, body)
+            continue
+
+        if event.channel == user_channel:
+            # keep the membership cache and subscriptions up to date
+            # with the chats the user has joined or left
+            data = json.loads(event.message)
+            match data["body"].get("type"):
+                case WSNotificationType.CHAT_CREATED:
+                    await join_chat(connection, data["body"]["chat_id"])
+                case WSNotificationType.CHAT_DELETED:
+                    await leave_chat(connection, data["body"]["chat_id"])
+
+        await connection.codec.send(websocket, event.get_frame(connection.codec))
+
+    if connection.subscriber.overflowed:
+        raise WebSocketDisconnect(
+            code=WSError.SLOW_CONSUMER,
+            reason=WSError.SLOW_CONSUMER.label,
+        )
 
 
 @router.websocket("/chat", name="chat")
-async def chat(  # noqa: ANN201
-    websocket: WebSocket,
-    session: AsyncSession = Depends(get_db_session),
-):
-    await websocket.accept()
+async def chat(websocket: WebSocket):  # noqa: ANN201
+    # sessions are only borrowed for single operations, as most of the time
+    # websockets are idle and must not hold pooled database connections
+    subprotocols = websocket.scope.get("subprotocols", [])
+    codec = negotiate_codec(subprotocols)
+    await websocket.accept(
+        subprotocol=codec.subprotocol if codec.subprotocol in subprotocols else None,
+    )
 
     user = None
     try:
         # wait for the first message with access token
-        data = await websocket.receive_json()
+        data = await receive_frame(websocket, codec)
 
         try:
-            data = WSAuthMessage(**data)
+            data = WSAuthMessage.model_validate(data)
         except ValidationError as e:
             # send error message with full description
-            await send_error(websocket, e.json())
+            await send_error(websocket, e.json(), codec)
             raise WebSocketDisconnect(
                 code=WSError.VALIDATION_ERROR,
                 reason=WSError.VALIDATION_ERROR.label,
             ) from e
 
-        user = await authenticate_user_token(
-            token=data.body.token,
-            session=session,
-            websocket=websocket,
-        )
-
-        user.last_online = None  # user online
-        await session.commit()
+        async with create_session() as session:
+            user = await authenticate_user_token(
+                token=data.body.token,
+                session=session,
+                websocket=websocket,
+            )
 
-        # TODO: notify other participants that user is online
+            # users of signed tokens are not loaded into the session
+            await session.execute(
+                update(User).where(User.id == user.id).values(last_online=None),
+            )  # user online
+            await session.commit()
 
-        async with create_task_group() as task_group:
-            task_group.start_soon(message_sender, websocket)
-            task_group.start_soon(message_receiver, websocket, user, session)
-    except WebSocketDisconnect as e:
+            # TODO: notify other participants that user is online
+
+            chat_ids = await get_user_chat_ids(user, session)
+
+        # listen only to the chats user participates in
+        # and to the personal channel for membership changes
+        channels = [get_chat_channel(chat_id) for chat_id in chat_ids]
+        channels.append(get_user_channel(user.id))
+
+        async with (
+            broadcast.subscribe(*channels) as subscriber,
+            create_task_group() as task_group,
+        ):
+            connection = ChatConnection(websocket, codec, user, subscriber, chat_ids)
+            task_group.start_soon(message_sender, connection)
+            task_group.start_soon(message_receiver, connection)
+    except* WebSocketDisconnect as eg:
+        # the task group wraps exceptions of its tasks into a group
+        e = eg.exceptions[0]
         if user:
-            user.last_online = datetime.now(UTC)  # user offline
-            await session.commit()
+            async with create_session() as session:
+                await session.execute(
+                    update(User)
+                    .where(User.id == user.id)
+                    .values(last_online=datetime.now(UTC)),  # user offline
+                )
+                await session.commit()
         await websocket.close(code=e.code, reason=e.reason)
 
 
@@ -164,63 +614,46 @@ async def create_chat(  # noqa: ANN201
     if not chat_creator_included:
         chat.participants.append(ParticipantCreate(id=user.id, is_admin=True))
 
-    match chat.type:
-        case ChatType.SAVED_MESSAGES:
-            query = select(Chat).where(
-                Chat.type == ChatType.SAVED_MESSAGES,
-                Chat.participants.any(
-                    ChatParticipant.participant_id.in_(
-                        [p.id for p in chat.participants],
-                    ),
-                ),
-            )
-            result = await session.execute(query)
-            if result.scalar():
-                raise ChatCreationHTTPException(
-                    detail="There is already Saved messages "
-                    "chat created for this user.",
-                )
-        case ChatType.DIALOGUE:
-            for participant in chat.participants:
-                # in a dialogue, both users are admins
-                participant.is_admin = True
-
-            participant_ids = [p.id for p in chat.participants]
-            num_participants = len(participant_ids)
-
-            subquery = (
-                select(ChatParticipant.chat_id)
-                .join(Chat)
-                .filter(Chat.type == ChatType.DIALOGUE)
-                .group_by(ChatParticipant.chat_id)
-                .having(
-                    func.count(ChatParticipant.participant_id) == num_participants,
-                    func.array_agg(ChatParticipant.participant_id).op("@>")(
-                        participant_ids,
-                    ),
-                )
-                .scalar_subquery()
-            )
-
-            query = select(Chat).where(Chat.id == subquery)
+    if chat.type == ChatType.DIALOGUE:
+        for participant in chat.participants:
+            # in a dialogue, both users are admins
+            participant.is_admin = True
 
-            result = await session.execute(query)
-            if result.scalar():
-                raise ChatCreationHTTPException(
-                    detail="There is already a dialogue created with this user.",
-                )
+    participant_ids = {p.id for p in chat.participants}
+    check_chat_participants(chat.type, participant_ids, user.id)
+    unique_key = get_chat_unique_key(chat.type, list(participant_ids))
+    if unique_key is not None and await chat_unique_key_exists(unique_key, session):
+        raise ChatCreationHTTPException(detail=DUPLICATE_CHAT_DETAILS[chat.type])
 
     chat_data = chat.model_dump()
     chat_data.pop("participants")
 
-    new_chat = Chat(**chat_data)
+    new_chat = Chat(**chat_data, unique_key=unique_key, summary=ChatSummary())
 
     session.add(new_chat)
 
     new_chat.add_participants(chat.participants)
-    await session.commit()
+    try:
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        # the same chat has been created concurrently
+        if unique_key is not None and await chat_unique_key_exists(
+            unique_key,
+            session,
+        ):
+            raise ChatCreationHTTPException(
+                detail=DUPLICATE_CHAT_DETAILS[chat.type],
+            ) from None
+        raise
     await session.refresh(new_chat)
 
+    await publish_membership_change(
+        new_chat.id,
+        [p.id for p in chat.participants],
+        WSNotificationType.CHAT_CREATED,
+    )
+
     return await session.scalar(
         select(Chat)
         .options(joinedload(Chat.participants).joinedload(ChatParticipant.participant))
@@ -228,7 +661,8 @@ async def create_chat(  # noqa: ANN201
     )
 
 
-@router.get("/chats", response_model=list[ChatRead])
+# superseded by the paginated inbox, messages are fetched page by page
+@router.get("/chats", response_model=list[ChatRead], deprecated=True)
 async def get_chats(  # noqa: ANN201
     user: User = Depends(get_current_active_user),
     session: AsyncSession = Depends(get_db_session),
@@ -237,7 +671,6 @@ async def get_chats(  # noqa: ANN201
         select(Chat)
         .options(
             joinedload(Chat.participants).joinedload(ChatParticipant.participant),
-            joinedload(Chat.messages),
         )
         .where(
             Chat.participants.any(ChatParticipant.participant_id == user.id),
@@ -248,6 +681,17 @@ async def get_chats(  # noqa: ANN201
     return result.unique().scalars().all()
 
 
+@router.get("/chats/inbox", response_model=InboxPage)
+async def get_inbox(  # noqa: ANN201
+    before: str | None = None,
+    since: datetime | None = None,
+    limit: int = Query(INBOX_PAGE_SIZE, ge=1, le=INBOX_PAGE_MAX_SIZE),
+    user: User = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_db_session),
+):
+    return await get_inbox_page(user, before, since, limit, session)
+
+
 @router.delete("/chats/{chat_id}")
 async def delete_chat(  # noqa: ANN201
     chat_id: int,
@@ -267,43 +711,193 @@ async def delete_chat(  # noqa: ANN201
         )
 
     if chat_participant.is_admin:
+        participant_ids = list(
+            await session.scalars(
+                select(ChatParticipant.participant_id).where(
+                    ChatParticipant.chat_id == chat_id,
+                ),
+            ),
+        )
         query = delete(Chat).where(Chat.id == chat_id)
         await session.execute(query)
     else:
+        participant_ids = [user.id]
         await session.delete(chat_participant)
     await session.commit()
 
+    await publish_membership_change(
+        chat_id,
+        participant_ids,
+        WSNotificationType.CHAT_DELETED,
+    )
+
     return Response(status_code=status.HTTP_200_OK)
 
 
-@router.get("/chats/{chat_id}/messages", response_model=list[MessageRead])
-async def get_messages(  # noqa: ANN201
+@router.get("/chats/{chat_id}/messages", response_model=MessagePage)
+async def get_messages(  # noqa: ANN201, PLR0913
     chat_id: int,
-    limit: int | None = None,
-    offset: int | None = None,
+    before: str | None = None,
+    after: str | None = None,
+    limit: int = Query(MESSAGES_PAGE_SIZE, ge=1, le=MESSAGES_PAGE_MAX_SIZE),
     user: User = Depends(get_current_active_user),
     session: AsyncSession = Depends(get_db_session),
 ):
-    query = (
-        select(Chat)
-        .join(Chat.participants)
-        .options(
-            contains_eager(Chat.participants),
+    if before is not None and after is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Only one of before and after can be specified",
         )
+
+    query = select(ChatParticipant).where(
+        ChatParticipant.chat_id == chat_id,
+        ChatParticipant.participant_id == user.id,
+    )
+    if not await session.scalar(query):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    return await get_messages_page(chat_id, before, after, limit, session)
+
+
+@router.get(
+    "/chats/{chat_id}/export",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+)
+async def export_chat(  # noqa: ANN201
+    request: Request,
+    chat_id: int,
+    since: datetime | None = None,
+    user: User = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_db_session),
+):
+    query = select(ChatParticipant).where(
+        ChatParticipant.chat_id == chat_id,
+        ChatParticipant.participant_id == user.id,
+    )
+    if not await session.scalar(query):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    headers = {
+        "Content-Disposition": f'attachment; filename="chat-{chat_id}.ndjson"',
+        "Vary": "Accept-Encoding",
+    }
+    compress = accepts_encoding(request.headers.get("accept-encoding", ""), "gzip")
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        stream_chat_export(chat_id, since, compress),
+        media_type="application/x-ndjson",
+        headers=headers,
+    )
+
+
+@router.get(
+    "/chats/{chat_id}/messages/{message_id}/file",
+    response_class=RangeFileResponse,
+    responses={206: {"description": "Requested range of the file"}},
+)
+async def download_file(  # noqa: ANN201
+    chat_id: int,
+    message_id: int,
+    user: User = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_db_session),
+):
+    query = (
+        select(Message.content)
+        .join(ChatParticipant, ChatParticipant.chat_id == Message.chat_id)
         .where(
-            Chat.id == chat_id,
+            Message.id == message_id,
+            Message.chat_id == chat_id,
+            Message.type.in_([MessageType.FILE, MessageType.VOICE]),
             ChatParticipant.participant_id == user.id,
         )
     )
-    chat = await session.scalar(query)
-    if not chat:
+    content = await session.scalar(query)
+    if content is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
-    query = (
-        select(Message).where(Message.chat_id == chat_id).order_by(Message.created_at)
+    try:
+        file = FileContent.model_validate_json(content)
+        path = blob_store.get_path(file.hash)
+    except ValueError as e:
+        # not a file of the blob store
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND) from e
+    return RangeFileResponse(
+        path,
+        filename=file.name,
+        # files are stored by their content, so they never change
+        headers={
+            "Cache-Control": "private, max-age=31536000, immutable",
+            "ETag": f'"{file.hash}"',
+        },
+    )
+
+
+@router.get("/chats/{chat_id}/messages/search", response_model=MessageSearchPage)
+async def search_chat_messages(  # noqa: ANN201, PLR0913
+    chat_id: int,
+    q: str = Query(min_length=1, max_length=SEARCH_QUERY_MAX_LENGTH),
+    before: str | None = None,
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_PAGE_MAX_SIZE),
+    user: User = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_db_session),
+):
+    chat_ids = select(ChatParticipant.chat_id).where(
+        ChatParticipant.chat_id == chat_id,
+        ChatParticipant.participant_id == user.id,
+    )
+    if not await session.scalar(chat_ids):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    return await search_messages(q, chat_ids, before, limit, session)
+
+
+@router.get("/messages/search", response_model=MessageSearchPage)
+async def search_all_messages(  # noqa: ANN201
+    q: str = Query(min_length=1, max_length=SEARCH_QUERY_MAX_LENGTH),
+    before: str | None = None,
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_PAGE_MAX_SIZE),
+    user: User = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_db_session),
+):
+    # only the chats user participates in are searched
+    chat_ids = select(ChatParticipant.chat_id).where(
+        ChatParticipant.participant_id == user.id,
     )
-    if limit is not None:
-        query = query.limit(limit)
-    if offset is not None:
-        query = query.offset(offset)
-    return await session.scalars(query)
+    return await search_messages(q, chat_ids, before, limit, session)
+
+
+@router.post("/chats/{chat_id}/read", response_model=ReadStateRead)
+async def read_messages(  # noqa: ANN201
+    chat_id: int,
+    read_data: ReadCreate,
+    user: User = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_db_session),
+):
+    participant = await session.get(ChatParticipant, (chat_id, user.id))
+    if not participant:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+
+    read_state = await mark_read(chat_id, user.id, read_data.message_id, session)
+    if not read_state:
+        # the watermark is already past the message
+        return participant
+
+    read_receipts.add(chat_id, user.id, read_data.message_id)
+    return read_state
+
+
+@router.get("/chats/unread", response_model=list[ReadStateRead])
+async def get_unread(  # noqa: ANN201
+    user: User = Depends(get_current_active_user),
+    session: AsyncSession = Depends(get_db_session),
+):
+    return await get_unread_counts(user, session)
+
+
+@router.get("/broadcast/stats", response_model=BroadcastStats)
+async def broadcast_stats(  # noqa: ANN201
+    user: User = Depends(get_current_admin_user),  # noqa: ARG001
+):
+    return broadcast.stats()
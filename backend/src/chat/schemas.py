@@ -1,8 +1,11 @@
 from datetime import datetime
+from typing import Annotated, Literal
 
-from pydantic import BaseModel, Field, model_validator, validator
+from pydantic import BaseModel, Field, RootModel, model_validator, validator
 
 from src.auth.schemas import UserRead
+from src.config import STORAGE_MAX_FILE_SIZE
+from src.storage import DIGEST_PATTERN, UPLOAD_ID_PATTERN
 
 from .enums import ChatType, MessageType, WSMessageType, WSNotificationType
 
@@ -37,7 +40,6 @@ class MessageRead(BaseModel):
     content: str
     author_id: int
     sender_id: int
-    is_read: bool
     is_edited: bool
     created_at: datetime
 
@@ -46,6 +48,29 @@ class MessageRead(BaseModel):
         use_enum_values = True
 
 
+class MessagePage(BaseModel):
+    # newest first
+    items: list[MessageRead]
+    # pass as `before` to get older messages
+    next_cursor: str | None
+    # pass as `after` to get newer messages
+    prev_cursor: str | None
+
+
+class MessageSearchResult(MessageRead):
+    chat_id: int
+    rank: float
+    # content fragments with matches wrapped in <mark>, the rest is escaped
+    snippet: str
+
+
+class MessageSearchPage(BaseModel):
+    # most relevant first
+    items: list[MessageSearchResult]
+    # pass as `before` to get less relevant results
+    next_cursor: str | None
+
+
 # ## Chat ###
 class ChatBase(BaseModel):
     type: ChatType
@@ -68,7 +93,41 @@ class ChatRead(ChatBase):
     name: str | None
     image_url: str | None
     participants: list[ParticipantRead]
-    messages: list[MessageRead]
+
+    class Config:
+        from_attributes = True
+
+
+class InboxChatRead(ChatBase):
+    id: int
+    name: str | None
+    image_url: str | None
+    participants: list[ParticipantRead]
+    last_message: MessageRead | None
+    last_activity_at: datetime
+    last_read_message_id: int | None
+    unread_count: int
+
+    class Config:
+        from_attributes = True
+
+
+class InboxPage(BaseModel):
+    # most recently active first
+    items: list[InboxChatRead]
+    # pass as `before` to get the next page
+    next_cursor: str | None
+
+
+class ReadCreate(BaseModel):
+    # everything up to this message, inclusive, is marked as read
+    message_id: int
+
+
+class ReadStateRead(BaseModel):
+    chat_id: int
+    last_read_message_id: int | None
+    unread_count: int
 
     class Config:
         from_attributes = True
@@ -92,6 +151,7 @@ class WSAuthBody(BaseModel):
 class WSNotificationBody(BaseModel):
     type: WSNotificationType
     user_id: int
+    chat_id: int
 
     class Config:
         extra = "forbid"
@@ -102,10 +162,58 @@ class WSMessageRead(MessageRead):
 
 
 class WSMessageBody(MessageCreate):
+    # file and voice messages are only created by finishing an upload
+    type: Literal[MessageType.TEXT]
+
+    class Config:
+        extra = "forbid"
+
+
+class WSResumeBody(BaseModel):
+    chat_id: int
+    # id of the last event received before reconnecting
+    last_event_id: str = Field(pattern=r"^\d+-\d+$")
+    # id of the last message received, so that messages replayed from the
+    # database are not sent twice
+    last_message_id: int | None = None
+
+    class Config:
+        extra = "forbid"
+
+
+class WSReadBody(ReadCreate):
+    chat_id: int
+
+    class Config:
+        extra = "forbid"
+
+
+class WSUploadBody(BaseModel):
+    """
+    Starts an upload, the file is then sent in binary frames. An interrupted
+    upload is resumed by sending its id again, the server replies with the
+    number of bytes it has already received.
+    """
+
+    chat_id: int
+    type: Literal[MessageType.FILE, MessageType.VOICE]
+    name: str = Field(min_length=1, max_length=255)
+    size: int = Field(gt=0, le=STORAGE_MAX_FILE_SIZE)
+    upload_id: str | None = Field(default=None, pattern=UPLOAD_ID_PATTERN)
+
     class Config:
         extra = "forbid"
 
 
+class FileContent(BaseModel):
+    """Content of file and voice messages."""
+
+    # sha256 of the file in the blob store
+    hash: str = Field(pattern=DIGEST_PATTERN)
+    name: str
+    size: int
+
+
 class WSMessageBase(BaseModel):
     type: WSMessageType
 
@@ -121,5 +229,46 @@ class WSAuthMessage(WSMessageBase):
         return value
 
 
-class WSMessage(WSMessageBase):
-    body: WSNotificationBody | WSMessageBody
+class WSNotificationMessage(WSMessageBase):
+    type: Literal[WSMessageType.NOTIFICATION]
+    body: WSNotificationBody
+
+
+class WSChatMessage(WSMessageBase):
+    type: Literal[WSMessageType.MESSAGE]
+    body: WSMessageBody
+
+
+class WSResumeMessage(WSMessageBase):
+    type: Literal[WSMessageType.RESUME]
+    body: WSResumeBody
+
+
+class WSReadMessage(WSMessageBase):
+    type: Literal[WSMessageType.READ]
+    body: WSReadBody
+
+
+class WSUploadMessage(WSMessageBase):
+    type: Literal[WSMessageType.UPLOAD]
+    body: WSUploadBody
+
+
+class WSMessage(RootModel):
+    # the body is validated against the model of the message type only
+    root: Annotated[
+        WSNotificationMessage
+        | WSChatMessage
+        | WSResumeMessage
+        | WSReadMessage
+        | WSUploadMessage,
+        Field(discriminator="type"),
+    ]
+
+
+class BroadcastStats(BaseModel):
+    subscribers: int
+    channels: int
+    queued: int
+    max_queue_depth: int
+    dropped: int
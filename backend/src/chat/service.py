@@ -1,17 +1,55 @@
 import asyncio
+from abc import ABC, abstractmethod
+from collections import Counter, defaultdict
 from collections.abc import AsyncGenerator, AsyncIterator
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
+from functools import cached_property
+from typing import TYPE_CHECKING, Any, Generic, TypeVar
 from urllib.parse import urlparse
 
-import asyncio_redis
+from asyncpg import Connection, InterfaceError, PostgresError
+from fastapi import WebSocket
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.exceptions import ConnectionError as RedisConnectionError
+from sqlalchemy import case, func, insert, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DBAPIError, IntegrityError
 
-from .exceptions import UnsubscribedError
+from src.auth.models import User
+from src.database import AsyncSession, create_session, engine
+
+from .codecs import Codec
+from .constants import NOTIFY_MAX_PAYLOAD_SIZE, RECONNECT_MAX_DELAY, RECONNECT_MIN_DELAY
+from .enums import OverflowPolicy, WSMessageType
+from .exceptions import (
+    BroadcastConnectionError,
+    MessageTooLargeError,
+    UnsubscribedError,
+)
+from .models import ChatParticipant, ChatSummary, Message
+from .utils import create_message_partitions, encode_event, get_chat_channel
+
+if TYPE_CHECKING:
+    from src.storage import BlobStore, Upload
+
+    from .schemas import WSUploadBody
+
+T = TypeVar("T")
 
 
 class Event:
-    def __init__(self: "Event", channel: str, message: str) -> None:
+    def __init__(
+        self: "Event",
+        channel: str,
+        message: str,
+        id: str | None = None,  # noqa: A002
+    ) -> None:
         self.channel = channel
         self.message = message
+        # position in the channel's stream, if the backend keeps one
+        self.id = id
+        # subprotocol -> frame in its encoding
+        self._frames: dict[str, str | bytes] = {}
 
     def __eq__(self: "Event", other: object) -> bool:
         return (
@@ -21,12 +59,52 @@ class Event:
         )
 
     def __repr__(self: "Event") -> str:
-        return f"Event(channel={self.channel!r}, message={self.message!r})"
+        return (
+            f"Event(channel={self.channel!r}, message={self.message!r}, "
+            f"id={self.id!r})"
+        )
+
+    @cached_property
+    def frame(self: "Event") -> str:
+        if self.id is None:
+            return self.message
+        # messages are JSON objects, the stream id is prepended to them once
+        # per event so that clients can resume from it after reconnecting
+        return f'{{"id": "{self.id}", {self.message[1:]}'
+
+    def get_frame(self: "Event", codec: Codec) -> str | bytes:
+        frame = self._frames.get(codec.subprotocol)
+        if frame is None:
+            frame = self._frames[codec.subprotocol] = codec.transcode(self.frame)
+        return frame
+
+
+class Gap(Event):
+    """Marks the place in a subscriber's queue where events were dropped."""
+
+    def __init__(self: "Gap") -> None:
+        super().__init__(channel="", message="")
+
+    def __repr__(self: "Gap") -> str:
+        return "Gap()"
 
 
 class Subscriber:
-    def __init__(self: "Subscriber", queue: asyncio.Queue) -> None:
-        self._queue = queue
+    def __init__(
+        self: "Subscriber",
+        queue_size: int,
+        overflow_policy: OverflowPolicy,
+    ) -> None:
+        # one extra slot is reserved for a gap marker or a stop signal
+        self._queue: asyncio.Queue[Event | None] = asyncio.Queue(queue_size + 1)
+        self._queue_size = queue_size
+        self._overflow_policy = overflow_policy
+        self._gap = False  # a gap marker is waiting in the queue
+        self._closed = False
+        # names of the channels this subscriber is currently listening to
+        self.channels: set[str] = set()
+        self.dropped = 0
+        self.overflowed = False
 
     async def __aiter__(self: "Subscriber") -> AsyncGenerator | None:
         try:
@@ -35,53 +113,502 @@ class Subscriber:
         except UnsubscribedError:
             pass
 
+    @property
+    def qsize(self: "Subscriber") -> int:
+        return self._queue.qsize()
+
     async def get(self: "Subscriber") -> Event:
         event = await self._queue.get()
         if event is None:
             raise UnsubscribedError
+        if isinstance(event, Gap):
+            self._gap = False
+        return event
+
+    def put_nowait(self: "Subscriber", event: Event) -> None:
+        if self._closed:
+            return
+
+        if not self._gap and self._queue.qsize() < self._queue_size:
+            self._queue.put_nowait(event)
+            return
+
+        self.dropped += 1
+        match self._overflow_policy:
+            case OverflowPolicy.DROP_OLDEST:
+                self._queue.get_nowait()
+                self._queue.put_nowait(event)
+            case OverflowPolicy.GAP:
+                # drop everything until the consumer reaches the marker
+                if not self._gap:
+                    self._gap = True
+                    self._queue.put_nowait(Gap())
+            case OverflowPolicy.DISCONNECT:
+                self.overflowed = True
+                self.close()
+
+    def put_gap(self: "Subscriber") -> None:
+        """Tells the consumer that events might have been missed."""
+        if self._closed or self._gap:
+            return
+        if self._queue.full():
+            self.dropped += 1
+            self._queue.get_nowait()
+        self._queue.put_nowait(Gap())
+
+    def close(self: "Subscriber") -> None:
+        if self._closed:
+            return
+
+        self._closed = True
+        # pending events won't be consumed anyway
+        while not self._queue.empty():
+            self._queue.get_nowait()
+        # a signal for Subscriber.get() to stop
+        self._queue.put_nowait(None)
+
+
+class ChatConnection:
+    """State of a single chat websocket."""
+
+    def __init__(  # noqa: PLR0913
+        self: "ChatConnection",
+        websocket: WebSocket,
+        codec: Codec,
+        user: User,
+        subscriber: Subscriber,
+        chat_ids: set[int],
+    ) -> None:
+        self.websocket = websocket
+        # encoding of the frames, negotiated as the websocket subprotocol
+        self.codec = codec
+        self.user = user
+        self.subscriber = subscriber
+        # chats the user participates in, loaded once on authentication
+        # and kept up to date by membership events from the user's channel
+        self.chat_ids = chat_ids
+        # file being received in binary frames and the message it's sent in
+        self.upload: Upload | None = None
+        self.upload_body: WSUploadBody | None = None
+
+
+class BatchQueue(Generic[T]):
+    """
+    Hands out queued items in batches collected for up to batch_window seconds
+    or until batch_size of them are queued, whichever comes first.
+    """
+
+    def __init__(self: "BatchQueue", batch_size: int, batch_window: float) -> None:
+        self._queue: asyncio.Queue[T] = asyncio.Queue()
+        self._batch_size = batch_size
+        self._batch_window = batch_window
+        self._batch_full = asyncio.Event()
+
+    def put_nowait(self: "BatchQueue", item: T) -> None:
+        self._queue.put_nowait(item)
+        if self._queue.qsize() >= self._batch_size:
+            self._batch_full.set()
+
+    def qsize(self: "BatchQueue") -> int:
+        return self._queue.qsize()
+
+    async def get_batch(self: "BatchQueue") -> list[T]:
+        batch = [await self._queue.get()]
+
+        # give other producers a chance to join the batch
+        if self._batch_window and self._queue.qsize() < self._batch_size - 1:
+            self._batch_full.clear()
+            with suppress(TimeoutError):
+                await asyncio.wait_for(self._batch_full.wait(), self._batch_window)
+
+        while len(batch) < self._batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+
+class BroadcastBackend(ABC):
+    # name of the config section with the backend's options
+    name: str
+
+    @abstractmethod
+    def __init__(self: "BroadcastBackend", url: str) -> None: ...
+
+    @abstractmethod
+    async def connect(self: "BroadcastBackend") -> None: ...
+
+    @abstractmethod
+    async def disconnect(self: "BroadcastBackend") -> None: ...
+
+    async def reconnect(self: "BroadcastBackend") -> None:
+        await self.disconnect()
+        await self.connect()
+
+    @abstractmethod
+    async def subscribe(self: "BroadcastBackend", channel: str) -> None: ...
+
+    @abstractmethod
+    async def unsubscribe(self: "BroadcastBackend", channel: str) -> None: ...
+
+    @abstractmethod
+    async def publish(self: "BroadcastBackend", channel: str, message: str) -> None: ...
+
+    @abstractmethod
+    async def next_published(self: "BroadcastBackend") -> Event: ...
+
+    async def history(
+        self: "BroadcastBackend",
+        channel: str,  # noqa: ARG002
+        after_id: str,  # noqa: ARG002
+        limit: int,  # noqa: ARG002
+    ) -> list[Event] | None:
+        """
+        Returns events published to the channel after the given one or None
+        if they aren't retained (backend doesn't keep history, they're too old
+        or there are more than limit of them).
+        """
+        return None
+
+
+class MemoryBackend(BroadcastBackend):
+    """
+    Single process backend, events are handed over as is without any
+    serialization or network round trips.
+    """
+
+    name = "memory"
+
+    def __init__(self: "MemoryBackend", url: str) -> None:  # noqa: ARG002
+        self._channels: set[str] = set()
+
+    async def connect(self: "MemoryBackend") -> None:
+        self._published: asyncio.Queue[Event] = asyncio.Queue()
+
+    async def disconnect(self: "MemoryBackend") -> None:
+        pass
+
+    async def subscribe(self: "MemoryBackend", channel: str) -> None:
+        self._channels.add(channel)
+
+    async def unsubscribe(self: "MemoryBackend", channel: str) -> None:
+        self._channels.discard(channel)
+
+    async def publish(self: "MemoryBackend", channel: str, message: str) -> None:
+        # nobody on this node listens to the channel
+        if channel in self._channels:
+            self._published.put_nowait(Event(channel=channel, message=message))
+
+    async def next_published(self: "MemoryBackend") -> Event:
+        return await self._published.get()
+
+
+class PostgresBackend(BroadcastBackend):
+    """
+    LISTEN/NOTIFY backend that reuses the application's database engine.
+
+    Postgres limits NOTIFY payloads to 8000 bytes, larger messages are
+    rejected with MessageTooLargeError before a connection is acquired.
+    """
+
+    name = "postgres"
+
+    def __init__(self: "PostgresBackend", url: str) -> None:  # noqa: ARG002
+        self._lock = asyncio.Lock()
+
+    async def connect(self: "PostgresBackend") -> None:
+        # None is put when the connection is lost
+        self._published: asyncio.Queue[Event | None] = asyncio.Queue()
+        # LISTEN is bound to a connection, so one is held for the whole lifetime
+        try:
+            self._listen_conn = await engine.connect()
+            raw_connection = await self._listen_conn.get_raw_connection()
+        except (OSError, DBAPIError) as e:
+            raise BroadcastConnectionError from e
+        self._driver_conn: Connection = raw_connection.driver_connection
+        self._driver_conn.add_termination_listener(self._on_termination)
+
+    async def disconnect(self: "PostgresBackend") -> None:
+        self._driver_conn.remove_termination_listener(self._on_termination)
+        if self._driver_conn.is_closed():
+            # a lost connection must not be returned to the pool
+            await self._listen_conn.invalidate()
+        await self._listen_conn.close()
+
+    def _on_termination(self: "PostgresBackend", connection: Connection) -> None:  # noqa: ARG002
+        self._published.put_nowait(None)
+
+    def _on_notification(
+        self: "PostgresBackend",
+        connection: Connection,  # noqa: ARG002
+        pid: int,  # noqa: ARG002
+        channel: str,
+        payload: str,
+    ) -> None:
+        self._published.put_nowait(Event(channel=channel, message=payload))
+
+    async def subscribe(self: "PostgresBackend", channel: str) -> None:
+        # asyncpg doesn't allow concurrent operations on a single connection
+        async with self._lock:
+            try:
+                await self._driver_conn.add_listener(channel, self._on_notification)
+            except (OSError, InterfaceError, PostgresError) as e:
+                raise BroadcastConnectionError from e
+
+    async def unsubscribe(self: "PostgresBackend", channel: str) -> None:
+        async with self._lock:
+            try:
+                await self._driver_conn.remove_listener(
+                    channel,
+                    self._on_notification,
+                )
+            except (OSError, InterfaceError, PostgresError) as e:
+                raise BroadcastConnectionError from e
+
+    async def publish(self: "PostgresBackend", channel: str, message: str) -> None:
+        if len(message.encode()) >= NOTIFY_MAX_PAYLOAD_SIZE:
+            raise MessageTooLargeError
+        try:
+            async with engine.connect() as connection:
+                await connection.execute(
+                    text("SELECT pg_notify(:channel, :message)"),
+                    {"channel": channel, "message": message},
+                )
+                await connection.commit()
+        except (OSError, DBAPIError) as e:
+            raise BroadcastConnectionError from e
+
+    async def next_published(self: "PostgresBackend") -> Event:
+        event = await self._published.get()
+        # notifications stop silently once the connection is lost
+        if event is None:
+            raise BroadcastConnectionError
         return event
 
 
-class RedisBackend:
-    def __init__(self: "RedisBackend", url: str) -> None:
-        parsed_url = urlparse(url)
-        self._host = parsed_url.hostname or "localhost"
-        self._port = parsed_url.port or 6379
-        self._password = parsed_url.password or None
+# appends the message to the channel's stream and publishes it prefixed
+# with the stream id in one round trip
+PUBLISH_TO_STREAM_SCRIPT = """
+local id = redis.call(
+    'XADD', KEYS[1], 'MAXLEN', '~', ARGV[3], '*', 'message', ARGV[2]
+)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('PUBLISH', ARGV[1], id .. ' ' .. ARGV[2])
+return id
+"""
+
+
+def stream_id_to_tuple(stream_id: str) -> tuple[int, int]:
+    milliseconds, sequence = stream_id.split("-")
+    return int(milliseconds), int(sequence)
+
+
+class RedisBackend(BroadcastBackend):
+    name = "redis"
+
+    def __init__(  # noqa: PLR0913
+        self: "RedisBackend",
+        url: str,
+        pool_size: int = 4,
+        batch_size: int = 64,
+        batch_window: float = 0.002,
+        stream_maxlen: int | None = None,
+        stream_ttl: int = 24 * 60 * 60,
+    ) -> None:
+        self._url = url
+        # when set, events are also appended to a capped stream per channel
+        # (kept for stream_ttl seconds after the last event) to be replayed
+        # to reconnecting clients
+        self._stream_maxlen = stream_maxlen
+        self._stream_ttl = stream_ttl
+        self._pool_size = pool_size
+        # publishes are collected for up to batch_window seconds
+        # or until batch_size of them are queued and sent as one pipeline
+        self._batch_size = batch_size
+        self._batch_window = batch_window
 
     async def connect(self: "RedisBackend") -> None:
-        kwargs = {
-            "host": self._host,
-            "port": self._port,
-            "password": self._password,
-        }
-        self._pub_conn = await asyncio_redis.Connection.create(**kwargs)
-        self._sub_conn = await asyncio_redis.Connection.create(**kwargs)
-        self._subscriber = await self._sub_conn.start_subscribe()
+        # hiredis is used for parsing replies whenever it's installed
+        self._pub_redis = Redis(
+            connection_pool=BlockingConnectionPool.from_url(
+                self._url,
+                max_connections=self._pool_size,
+                decode_responses=True,
+            ),
+        )
+        # all channels are multiplexed over a single connection
+        self._sub_redis = Redis.from_url(self._url, decode_responses=True)
+        self._publish_to_stream = self._pub_redis.register_script(
+            PUBLISH_TO_STREAM_SCRIPT,
+        )
+        await self._connect_pubsub()
+
+        self._publish_queue: BatchQueue[tuple[str, str, asyncio.Future]] = BatchQueue(
+            self._batch_size,
+            self._batch_window,
+        )
+        # at most pool_size batches are in flight at a time
+        self._batch_slots = asyncio.Semaphore(self._pool_size)
+        self._batch_tasks: set[asyncio.Task] = set()
+        self._publisher_task = asyncio.create_task(self._publisher())
+
+    async def _connect_pubsub(self: "RedisBackend") -> None:
+        self._pubsub = self._sub_redis.pubsub(ignore_subscribe_messages=True)
+        try:
+            await self._pubsub.connect()
+        except RedisConnectionError as e:
+            raise BroadcastConnectionError from e
+
+    async def reconnect(self: "RedisBackend") -> None:
+        await self._pubsub.aclose()
+        await self._connect_pubsub()
 
     async def disconnect(self: "RedisBackend") -> None:
-        self._pub_conn.close()
-        self._sub_conn.close()
+        self._publisher_task.cancel()
+        for task in self._batch_tasks:
+            task.cancel()
+        await self._pubsub.aclose()
+        await self._sub_redis.aclose()
+        await self._pub_redis.aclose(close_connection_pool=True)
 
     async def subscribe(self: "RedisBackend", channel: str) -> None:
-        await self._subscriber.subscribe([channel])
+        try:
+            await self._pubsub.subscribe(channel)
+        except RedisConnectionError as e:
+            raise BroadcastConnectionError from e
 
     async def unsubscribe(self: "RedisBackend", channel: str) -> None:
-        await self._subscriber.unsubscribe([channel])
+        try:
+            await self._pubsub.unsubscribe(channel)
+        except RedisConnectionError as e:
+            raise BroadcastConnectionError from e
 
     async def publish(self: "RedisBackend", channel: str, message: str) -> None:
-        await self._pub_conn.publish(channel, message)
+        future = asyncio.get_running_loop().create_future()
+        self._publish_queue.put_nowait((channel, message, future))
+        await future
+
+    async def _publisher(self: "RedisBackend") -> None:
+        while True:
+            batch = await self._publish_queue.get_batch()
+            await self._batch_slots.acquire()
+            task = asyncio.create_task(self._send_batch(batch))
+            self._batch_tasks.add(task)
+            task.add_done_callback(self._batch_tasks.discard)
+
+    async def _send_batch(
+        self: "RedisBackend",
+        batch: list[tuple[str, str, asyncio.Future]],
+    ) -> None:
+        try:
+            pipeline = self._pub_redis.pipeline(transaction=False)
+            for channel, message, _ in batch:
+                if self._stream_maxlen:
+                    await self._publish_to_stream(
+                        keys=[self._get_stream_key(channel)],
+                        args=[channel, message, self._stream_maxlen, self._stream_ttl],
+                        client=pipeline,
+                    )
+                else:
+                    pipeline.publish(channel, message)
+            results = await pipeline.execute(raise_on_error=False)
+        except RedisConnectionError as e:
+            results = [BroadcastConnectionError(e)] * len(batch)
+        except Exception as e:  # noqa: BLE001
+            # publishers must never be left waiting
+            results = [e] * len(batch)
+        finally:
+            self._batch_slots.release()
+
+        for (_, _, future), result in zip(batch, results, strict=True):
+            if future.done():  # publisher has been cancelled
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(None)
 
     async def next_published(self: "RedisBackend") -> Event:
-        message = await self._subscriber.next_published()
-        return Event(channel=message.channel, message=message.value)
+        while True:
+            try:
+                message = await self._pubsub.get_message(timeout=None)
+            except RedisConnectionError as e:
+                raise BroadcastConnectionError from e
+            # subscribe and unsubscribe confirmations are skipped
+            if message is None:
+                continue
+            if self._stream_maxlen:
+                id_, data = message["data"].split(" ", 1)
+                return Event(channel=message["channel"], message=data, id=id_)
+            return Event(channel=message["channel"], message=message["data"])
+
+    @staticmethod
+    def _get_stream_key(channel: str) -> str:
+        return f"stream:{channel}"
+
+    async def history(
+        self: "RedisBackend",
+        channel: str,
+        after_id: str,
+        limit: int,
+    ) -> list[Event] | None:
+        if not self._stream_maxlen:
+            return None
+
+        stream_key = self._get_stream_key(channel)
+        try:
+            pipeline = self._pub_redis.pipeline(transaction=False)
+            pipeline.xrange(stream_key, count=1)
+            pipeline.xrange(stream_key, min=f"({after_id}", count=limit + 1)
+            oldest, entries = await pipeline.execute()
+        except RedisConnectionError as e:
+            raise BroadcastConnectionError from e
+
+        # the stream has been trimmed past the event, some may be missing
+        if not oldest:
+            return None
+        oldest_id, _ = oldest[0]
+        if stream_id_to_tuple(oldest_id) > stream_id_to_tuple(after_id):
+            return None
+        if len(entries) > limit:
+            return None
+
+        return [
+            Event(channel=channel, message=fields["message"], id=id_)
+            for id_, fields in entries
+        ]
+
+
+BACKENDS: dict[str, type[BroadcastBackend]] = {
+    "memory": MemoryBackend,
+    "postgres": PostgresBackend,
+    "postgresql": PostgresBackend,
+    "redis": RedisBackend,
+    "rediss": RedisBackend,
+}
 
 
 class Broadcast:
-    def __init__(self: "Broadcast", url: str) -> None:
-        self._backend = RedisBackend(url)
-        # a dict contaning channel names as keys and a set of queued messages
-        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+    def __init__(
+        self: "Broadcast",
+        url: str,
+        queue_size: int = 256,
+        overflow_policy: OverflowPolicy | str = OverflowPolicy.DROP_OLDEST,
+        backend_options: dict[str, dict[str, Any]] | None = None,
+    ) -> None:
+        scheme = urlparse(url).scheme
+        if scheme not in BACKENDS:
+            msg = f"Unsupported broadcast backend: {scheme!r}"
+            raise ValueError(msg)
+        backend = BACKENDS[scheme]
+        # options are keyed by backend, only the selected one's are passed
+        options = (backend_options or {}).get(backend.name, {})
+        self._backend = backend(url, **options)
+        self._queue_size = queue_size
+        self._overflow_policy = OverflowPolicy(overflow_policy)
+        # a dict contaning channel names as keys and a set of their subscribers
+        self._subscribers: dict[str, set[Subscriber]] = {}
+        self._active_subscribers: set[Subscriber] = set()
+        # events dropped by subscribers that are already gone
+        self._dropped = 0
 
     async def connect(self: "Broadcast") -> None:
         await self._backend.connect()
@@ -96,32 +623,391 @@ class Broadcast:
 
     async def _listen(self: "Broadcast") -> None:
         while True:
-            event = await self._backend.next_published()
-            for queue in self._subscribers.get(event.channel, set()):
-                await queue.put(event)
+            try:
+                event = await self._backend.next_published()
+            except BroadcastConnectionError:
+                await self._reconnect()
+                continue
+
+            # never wait for a slow subscriber, it would delay everyone else
+            for subscriber in self._subscribers.get(event.channel, set()):
+                subscriber.put_nowait(event)
+
+    async def _reconnect(self: "Broadcast") -> None:
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self._backend.reconnect()
+                # restore subscriptions of all active connections
+                for channel in list(self._subscribers):
+                    await self._backend.subscribe(channel)
+            except BroadcastConnectionError:
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+            else:
+                # events published while disconnected are lost
+                for subscriber in self._active_subscribers:
+                    subscriber.put_gap()
+                return
+
+    def stats(self: "Broadcast") -> dict[str, int]:
+        queue_sizes = [s.qsize for s in self._active_subscribers]
+        return {
+            "subscribers": len(self._active_subscribers),
+            "channels": len(self._subscribers),
+            "queued": sum(queue_sizes),
+            "max_queue_depth": max(queue_sizes, default=0),
+            "dropped": self._dropped + sum(s.dropped for s in self._active_subscribers),
+        }
 
     async def publish(self: "Broadcast", channel: str, message: str) -> None:
         await self._backend.publish(channel, message)
 
+    async def history(
+        self: "Broadcast",
+        channel: str,
+        after_id: str,
+        limit: int,
+    ) -> list[Event] | None:
+        return await self._backend.history(channel, after_id, limit)
+
+    async def add_channel(
+        self: "Broadcast",
+        subscriber: Subscriber,
+        channel: str,
+    ) -> None:
+        if channel in subscriber.channels:
+            return
+
+        subscriber.channels.add(channel)
+        # register the subscriber before awaiting the backend so that
+        # concurrent subscriptions to the same channel don't override each other
+        subscribers = self._subscribers.setdefault(channel, set())
+        subscribers.add(subscriber)
+        if len(subscribers) == 1:
+            # the channel is restored from self._subscribers after reconnecting
+            with suppress(BroadcastConnectionError):
+                await self._backend.subscribe(channel)
+
+    async def remove_channel(
+        self: "Broadcast",
+        subscriber: Subscriber,
+        channel: str,
+    ) -> None:
+        if channel not in subscriber.channels:
+            return
+
+        subscriber.channels.remove(channel)
+        self._subscribers[channel].remove(subscriber)
+        # no active connections left
+        if not self._subscribers[channel]:
+            del self._subscribers[channel]
+            with suppress(BroadcastConnectionError):
+                await self._backend.unsubscribe(channel)
+
     @asynccontextmanager
     async def subscribe(
         self: "Broadcast",
-        channel: str,
+        *channels: str,
     ) -> AsyncIterator[Subscriber]:
-        queue = asyncio.Queue()
+        subscriber = Subscriber(self._queue_size, self._overflow_policy)
+        self._active_subscribers.add(subscriber)
 
         try:
-            if not self._subscribers.get(channel):
-                await self._backend.subscribe(channel)
-                self._subscribers[channel] = {queue}
-            else:
-                self._subscribers[channel].add(queue)
-            yield Subscriber(queue)
+            for channel in channels:
+                await self.add_channel(subscriber, channel)
+            yield subscriber
         finally:
-            self._subscribers[channel].remove(queue)
-            # no active connections left
-            if not self._subscribers.get(channel):
-                del self._subscribers[channel]
-                await self._backend.unsubscribe(channel)
-            # a signal for Subscriber.get() to stop
-            await queue.put(None)
+            for channel in subscriber.channels.copy():
+                await self.remove_channel(subscriber, channel)
+            self._active_subscribers.remove(subscriber)
+            self._dropped += subscriber.dropped
+            subscriber.close()
+
+
+class MessageWriter:
+    """
+    Inserts messages from all connections of the node in batches, so that
+    a single multi-row INSERT and commit is done per batch instead of
+    one per message.
+    """
+
+    def __init__(
+        self: "MessageWriter",
+        batch_size: int = 100,
+        batch_window: float = 0.005,
+    ) -> None:
+        self._batch_size = batch_size
+        self._batch_window = batch_window
+
+    async def start(self: "MessageWriter") -> None:
+        self._queue: BatchQueue[tuple[dict[str, Any], asyncio.Future]] = BatchQueue(
+            self._batch_size,
+            self._batch_window,
+        )
+        self._writer_task = asyncio.create_task(self._write())
+
+    async def stop(self: "MessageWriter") -> None:
+        if self._writer_task.done():
+            self._writer_task.result()
+        else:
+            self._writer_task.cancel()
+
+    async def write(self: "MessageWriter", values: dict[str, Any]) -> Message:
+        """Returns the message once it's committed."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((values, future))
+        return await future
+
+    async def _write(self: "MessageWriter") -> None:
+        while True:
+            batch = await self._queue.get_batch()
+            await self._flush(batch)
+
+    @staticmethod
+    async def _increment_unread_counts(
+        session: AsyncSession,
+        messages: list[Message],
+    ) -> None:
+        authors: defaultdict[int, Counter[int]] = defaultdict(Counter)
+        for message in messages:
+            authors[message.chat_id][message.author_id] += 1
+
+        # one UPDATE per chat in the batch, chats are sorted so that
+        # concurrent writers lock participants in the same order
+        for chat_id in sorted(authors):
+            total = authors[chat_id].total()
+            # own messages are not counted as unread
+            increment = case(
+                {
+                    author_id: total - count
+                    for author_id, count in authors[chat_id].items()
+                },
+                value=ChatParticipant.participant_id,
+                else_=total,
+            )
+            await session.execute(
+                update(ChatParticipant)
+                .where(ChatParticipant.chat_id == chat_id)
+                .values(unread_count=ChatParticipant.unread_count + increment)
+                .execution_options(synchronize_session=False),
+            )
+
+    @staticmethod
+    async def _update_summaries(
+        session: AsyncSession,
+        messages: list[Message],
+    ) -> None:
+        summaries: dict[int, dict[str, Any]] = {}
+        for message in messages:
+            summary = summaries.setdefault(message.chat_id, {"message_count": 0})
+            summary["message_count"] += 1
+            # messages are returned in the order of their ids
+            summary.update(
+                chat_id=message.chat_id,
+                last_message_id=message.id,
+                last_message_at=message.created_at,
+                last_author_id=message.author_id,
+                last_activity_at=message.created_at,
+            )
+
+        query = pg_insert(ChatSummary).values(
+            [summaries[chat_id] for chat_id in sorted(summaries)],
+        )
+        # batches of other writers may be committed out of order
+        is_newer = query.excluded.last_message_id > func.coalesce(
+            ChatSummary.last_message_id,
+            0,
+        )
+        query = query.on_conflict_do_update(
+            index_elements=[ChatSummary.chat_id],
+            set_={
+                "message_count": ChatSummary.message_count
+                + query.excluded.message_count,
+                **{
+                    column: case(
+                        (is_newer, query.excluded[column]),
+                        else_=ChatSummary.__table__.c[column],
+                    )
+                    for column in (
+                        "last_message_id",
+                        "last_message_at",
+                        "last_author_id",
+                        "last_activity_at",
+                    )
+                },
+            },
+        )
+        await session.execute(query)
+
+    async def _flush(
+        self: "MessageWriter",
+        batch: list[tuple[dict[str, Any], asyncio.Future]],
+    ) -> None:
+        try:
+            async with create_session() as session:
+                messages = list(
+                    await session.scalars(
+                        insert(Message).returning(
+                            Message,
+                            sort_by_parameter_order=True,
+                        ),
+                        [values for values, _ in batch],
+                    ),
+                )
+                await self._increment_unread_counts(session, messages)
+                await self._update_summaries(session, messages)
+                await session.commit()
+        except IntegrityError as e:
+            if len(batch) == 1:
+                results = [e]
+            else:
+                # write the rest of the batch without the invalid rows
+                for item in batch:
+                    await self._flush([item])
+                return
+        except Exception as e:  # noqa: BLE001
+            # writers must never be left waiting
+            results = [e] * len(batch)
+        else:
+            results = messages
+
+        for (_, future), result in zip(batch, results, strict=True):
+            if future.done():  # writer has been cancelled
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+class MessagePartitionMaintainer:
+    """
+    Creates monthly partitions of the message table ahead of time, so that
+    messages can always be inserted. Old partitions are detached by the
+    detach-partitions command.
+    """
+
+    def __init__(
+        self: "MessagePartitionMaintainer",
+        months_ahead: int,
+        interval: float,
+    ) -> None:
+        self._months_ahead = months_ahead
+        self._interval = interval
+
+    async def start(self: "MessagePartitionMaintainer") -> None:
+        await self._create_partitions()
+        self._maintainer_task = asyncio.create_task(self._maintainer())
+
+    async def stop(self: "MessagePartitionMaintainer") -> None:
+        if self._maintainer_task.done():
+            self._maintainer_task.result()
+        else:
+            self._maintainer_task.cancel()
+
+    async def _create_partitions(self: "MessagePartitionMaintainer") -> None:
+        async with create_session() as session:
+            await create_message_partitions(session, self._months_ahead)
+
+    async def _maintainer(self: "MessagePartitionMaintainer") -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            # partitions exist months ahead, so it's retried on the next check
+            with suppress(DBAPIError, OSError):
+                await self._create_partitions()
+
+
+class UploadSweeper:
+    """
+    Periodically removes uploads that haven't been resumed for a while, the
+    received part of an upload is kept after its connection closes so that
+    it can be resumed on another one.
+    """
+
+    def __init__(
+        self: "UploadSweeper",
+        store: "BlobStore",
+        max_age: float,
+        interval: float,
+    ) -> None:
+        self._store = store
+        self._max_age = max_age
+        self._interval = interval
+
+    async def start(self: "UploadSweeper") -> None:
+        self._sweeper_task = asyncio.create_task(self._sweeper())
+
+    async def stop(self: "UploadSweeper") -> None:
+        if self._sweeper_task.done():
+            self._sweeper_task.result()
+        else:
+            self._sweeper_task.cancel()
+
+    async def _sweeper(self: "UploadSweeper") -> None:
+        while True:
+            # retried on the next run if the store is unavailable
+            with suppress(OSError):
+                await self._store.remove_stale_uploads(self._max_age)
+            await asyncio.sleep(self._interval)
+
+
+class ReadReceiptCoalescer:
+    """
+    Collects read watermarks moved within a window and publishes them as
+    a single event per chat, instead of one per participant and message
+    while the chat is being scrolled through.
+    """
+
+    def __init__(
+        self: "ReadReceiptCoalescer",
+        broadcast: Broadcast,
+        window: float,
+    ) -> None:
+        self._broadcast = broadcast
+        self._window = window
+
+    async def start(self: "ReadReceiptCoalescer") -> None:
+        # chat id -> user id -> last read message id
+        self._pending: defaultdict[int, dict[int, int]] = defaultdict(dict)
+        self._added = asyncio.Event()
+        self._publisher_task = asyncio.create_task(self._publisher())
+
+    async def stop(self: "ReadReceiptCoalescer") -> None:
+        if self._publisher_task.done():
+            self._publisher_task.result()
+        else:
+            self._publisher_task.cancel()
+
+    def add(
+        self: "ReadReceiptCoalescer",
+        chat_id: int,
+        user_id: int,
+        message_id: int,
+    ) -> None:
+        receipts = self._pending[chat_id]
+        receipts[user_id] = max(message_id, receipts.get(user_id, message_id))
+        self._added.set()
+
+    async def _publisher(self: "ReadReceiptCoalescer") -> None:
+        while True:
+            await self._added.wait()
+            await asyncio.sleep(self._window)
+            self._added.clear()
+            pending, self._pending = self._pending, defaultdict(dict)
+
+            for chat_id, receipts in pending.items():
+                body = {
+                    "chat_id": chat_id,
+                    "receipts": [
+                        {"user_id": user_id, "message_id": message_id}
+                        for user_id, message_id in receipts.items()
+                    ],
+                }
+                # receipts are not critical, clients get the watermarks
+                # from the inbox after reconnecting
+                with suppress(BroadcastConnectionError):
+                    await self._broadcast.publish(
+                        channel=get_chat_channel(chat_id),
+                        message=encode_event(WSMessageType.READ, body),
+                    )
@@ -1,31 +1,546 @@
+import base64
+import binascii
+import html
+import json
+import re
+import zlib
+from collections.abc import AsyncIterator
+from datetime import UTC, datetime
+from typing import TYPE_CHECKING, Any, NamedTuple
+
 from fastapi import HTTPException, WebSocket, status
-from sqlalchemy import select
+from sqlalchemy import Select, and_, func, or_, select, text, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 
 from src.auth.models import User
-from src.database import AsyncSession
+from src.database import AsyncSession, create_session
+
+from .codecs import Codec, json_codec
+from .constants import (
+    CHAT_CHANNEL_PREFIX,
+    EXPORT_BATCH_SIZE,
+    MESSAGE_PARTITION_LOCK_ID,
+    SEARCH_CONFIG,
+    SEARCH_HEADLINE_OPTIONS,
+    SEARCH_HIGHLIGHT_START,
+    SEARCH_HIGHLIGHT_STOP,
+    SEARCH_MAX_CANDIDATES,
+    USER_CHANNEL_PREFIX,
+)
+from .enums import ChatType, WSMessageType
+from .exceptions import ChatCreationHTTPException, InvalidCursorHTTPException
+from .models import Chat, ChatParticipant, ChatSummary, Message
+from .schemas import (
+    InboxChatRead,
+    InboxPage,
+    MessageCreate,
+    MessagePage,
+    MessageRead,
+    MessageSearchPage,
+    MessageSearchResult,
+    ReadStateRead,
+    WSMessageRead,
+)
+
+if TYPE_CHECKING:
+    from .service import MessageWriter
+
+# bounds of a range partition, as returned by pg_get_expr
+PARTITION_BOUND_PATTERN = re.compile(r"FROM \((.+)\) TO \((.+)\)")
+
+
+class MessagePartition(NamedTuple):
+    name: str
+    # None for the partition of messages created before partitioning
+    lower: datetime | None
+    upper: datetime
+
+
+def get_chat_channel(chat_id: int) -> str:
+    return f"{CHAT_CHANNEL_PREFIX}:{chat_id}"
+
+
+def get_user_channel(user_id: int) -> str:
+    return f"{USER_CHANNEL_PREFIX}:{user_id}"
+
+
+def get_chat_unique_key(chat_type: ChatType, participant_ids: list[int]) -> str | None:
+    """
+    Returns the key of chats that may exist only once for their participants,
+    i.e. the dialogue of a pair of users and the saved messages of a user.
+    """
+    match chat_type:
+        case ChatType.DIALOGUE:
+            return f"{chat_type}:{min(participant_ids)}:{max(participant_ids)}"
+        case ChatType.SAVED_MESSAGES:
+            return f"{chat_type}:{min(participant_ids)}"
+    return None
+
+
+def check_chat_participants(
+    chat_type: ChatType,
+    participant_ids: set[int],
+    creator_id: int,
+) -> None:
+    """
+    Makes sure dialogues and saved messages have the exact participants
+    their unique keys are built from.
+    """
+    if chat_type == ChatType.DIALOGUE and len(participant_ids) != 2:  # noqa: PLR2004
+        raise ChatCreationHTTPException(
+            detail="A dialogue should have exactly two distinct participants.",
+        )
+    if chat_type == ChatType.SAVED_MESSAGES and participant_ids != {creator_id}:
+        raise ChatCreationHTTPException(
+            detail="Saved messages chat should only have its creator as participant.",
+        )
+
+
+async def chat_unique_key_exists(unique_key: str, session: AsyncSession) -> bool:
+    query = select(Chat.id).where(Chat.unique_key == unique_key)
+    return await session.scalar(query) is not None
+
+
+async def is_chat_participant(
+    chat_id: int,
+    user_id: int,
+    session: AsyncSession,
+) -> bool:
+    return await session.get(ChatParticipant, (chat_id, user_id)) is not None
+
+
+async def get_user_chat_ids(user: User, session: AsyncSession) -> set[int]:
+    query = select(ChatParticipant.chat_id).where(
+        ChatParticipant.participant_id == user.id,
+    )
+    return set(await session.scalars(query))
+
+
+def to_naive_utc(value: datetime) -> datetime:
+    """Converts an aware datetime to UTC without a zone, as stored in columns."""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(UTC).replace(tzinfo=None)
 
-from .models import Chat, ChatParticipant, Message
-from .schemas import MessageCreate, WSMessageRead
 
+def encode_event(msg_type: WSMessageType, body: dict[str, Any]) -> str:
+    return json.dumps({"type": msg_type.value, "body": body}, default=str)
 
-async def send_error(websocket: WebSocket, error: dict) -> None:
-    await websocket.send_json({"error": error})
+
+async def get_messages_since(
+    chat_id: int,
+    since: datetime,
+    after_id: int | None,
+    limit: int,
+    session: AsyncSession,
+) -> list[WSMessageRead]:
+    """
+    Returns messages created at or after `since` with ids greater than
+    `after_id`, oldest first.
+    """
+    query = (
+        select(Message)
+        .where(Message.chat_id == chat_id, Message.created_at >= since)
+        .order_by(Message.created_at, Message.id)
+        .limit(limit)
+    )
+    if after_id is not None:
+        query = query.where(Message.id > after_id)
+    return [WSMessageRead.model_validate(m) for m in await session.scalars(query)]
+
+
+async def stream_chat_export(
+    chat_id: int,
+    since: datetime | None,
+    compress: bool,  # noqa: FBT001
+) -> AsyncIterator[bytes]:
+    """
+    Yields NDJSON lines of the chat's messages created at or after `since`,
+    oldest first, gzipped if `compress` is set. Rows are fetched from a
+    server-side cursor, so memory use doesn't depend on the chat size, but
+    a connection is held until the export is streamed.
+    """
+    columns = [Message.__table__.c[field] for field in MessageRead.model_fields]
+    query = (
+        select(*columns)
+        .where(Message.chat_id == chat_id)
+        .order_by(Message.created_at, Message.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    if since is not None:
+        query = query.where(Message.created_at >= to_naive_utc(since))
+
+    # 16 + MAX_WBITS makes zlib write a gzip header and trailer
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+    # the request's session is closed before the response is streamed
+    async with create_session() as session:
+        result = await session.stream(query)
+        async for rows in result.mappings().partitions():
+            chunk = "".join(
+                json.dumps(dict(row), default=str) + "\n" for row in rows
+            ).encode()
+            if compressor is None:
+                yield chunk
+            elif compressed := compressor.compress(chunk):
+                yield compressed
+
+    if compressor is not None:
+        yield compressor.flush()
+
+
+def encode_cursor(key: datetime | float, id_: int) -> str:
+    value = key.isoformat() if isinstance(key, datetime) else key
+    data = json.dumps([value, id_])
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(
+    cursor: str,
+    key_type: type[datetime | float] = datetime,
+) -> tuple[datetime | float, int]:
+    try:
+        key, id_ = json.loads(base64.urlsafe_b64decode(cursor))
+        if key_type is datetime:
+            return datetime.fromisoformat(key), int(id_)
+        return float(key), int(id_)
+    except (binascii.Error, TypeError, ValueError) as e:
+        raise InvalidCursorHTTPException from e
+
+
+def format_snippet(snippet: str) -> str:
+    # message content is escaped, so that only the highlighting is markup
+    return (
+        html.escape(snippet)
+        .replace(SEARCH_HIGHLIGHT_START, "<mark>")
+        .replace(SEARCH_HIGHLIGHT_STOP, "</mark>")
+    )
+
+
+async def search_messages(
+    text: str,
+    chat_ids: Select,
+    before: str | None,
+    limit: int,
+    session: AsyncSession,
+) -> MessageSearchPage:
+    """Searches messages of the chats selected by `chat_ids`."""
+    query_ts = func.websearch_to_tsquery(SEARCH_CONFIG, text)
+
+    # matches are found with the GIN index, ranking has to read the vector of
+    # every row it ranks, so only the most recent matches are ranked
+    candidates = (
+        select(Message.id, Message.created_at, Message.search_vector)
+        .where(
+            Message.search_vector.bool_op("@@")(query_ts),
+            Message.chat_id.in_(chat_ids),
+        )
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(SEARCH_MAX_CANDIDATES)
+        .subquery()
+    )
+    rank = func.ts_rank_cd(candidates.c.search_vector, query_ts)
+    page = (
+        select(candidates.c.id, candidates.c.created_at, rank.label("rank"))
+        .order_by(rank.desc(), candidates.c.id.desc())
+        .limit(limit + 1)
+    )
+    if before is not None:
+        page = page.where(
+            tuple_(rank, candidates.c.id) < decode_cursor(before, float),
+        )
+    page = page.subquery()
+
+    # headlines are expensive, so they are built for the page rows only
+    snippet = func.ts_headline(
+        SEARCH_CONFIG,
+        Message.content,
+        query_ts,
+        SEARCH_HEADLINE_OPTIONS,
+    )
+    query = (
+        select(Message, page.c.rank, snippet)
+        .join(
+            page,
+            and_(page.c.id == Message.id, page.c.created_at == Message.created_at),
+        )
+        .order_by(page.c.rank.desc(), page.c.id.desc())
+    )
+
+    rows = (await session.execute(query)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = [
+        MessageSearchResult(
+            **MessageRead.model_validate(message).model_dump(),
+            chat_id=message.chat_id,
+            rank=rank,
+            snippet=format_snippet(snippet),
+        )
+        for message, rank, snippet in rows
+    ]
+    return MessageSearchPage(
+        items=items,
+        next_cursor=encode_cursor(items[-1].rank, items[-1].id) if has_more else None,
+    )
+
+
+async def get_messages_page(
+    chat_id: int,
+    before: str | None,
+    after: str | None,
+    limit: int,
+    session: AsyncSession,
+) -> MessagePage:
+    # (created_at, id) row comparisons walk the (chat_id, created_at, id) index,
+    # so every page costs the same regardless of how far back it is
+    key = tuple_(Message.created_at, Message.id)
+    query = select(Message).where(Message.chat_id == chat_id)
+    if after is not None:
+        query = query.where(key > decode_cursor(after)).order_by(
+            Message.created_at.asc(),
+            Message.id.asc(),
+        )
+    else:
+        if before is not None:
+            query = query.where(key < decode_cursor(before))
+        query = query.order_by(Message.created_at.desc(), Message.id.desc())
+
+    # one extra row tells whether there is another page
+    messages = list(await session.scalars(query.limit(limit + 1)))
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if after is not None:
+        messages.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = before is not None, has_more
+
+    oldest, newest = (messages[-1], messages[0]) if messages else (None, None)
+    return MessagePage(
+        items=[MessageRead.model_validate(m) for m in messages],
+        next_cursor=encode_cursor(oldest.created_at, oldest.id) if has_older else None,
+        prev_cursor=encode_cursor(newest.created_at, newest.id) if has_newer else None,
+    )
+
+
+async def get_inbox_page(
+    user: User,
+    before: str | None,
+    since: datetime | None,
+    limit: int,
+    session: AsyncSession,
+) -> InboxPage:
+    # the last message and activity time are kept in the chat summary,
+    # so neither depends on the size of the chats' history
+    last_activity_at = ChatSummary.last_activity_at
+    query = (
+        select(
+            Chat,
+            Message,
+            last_activity_at,
+            ChatParticipant.last_read_message_id,
+            ChatParticipant.unread_count,
+        )
+        .join(Chat.participants)
+        .join(ChatSummary, ChatSummary.chat_id == Chat.id)
+        # created_at lets the last message be looked up in a single partition
+        .outerjoin(
+            Message,
+            and_(
+                Message.id == ChatSummary.last_message_id,
+                Message.created_at == ChatSummary.last_message_at,
+            ),
+        )
+        .options(
+            selectinload(Chat.participants).joinedload(ChatParticipant.participant),
+        )
+        .where(ChatParticipant.participant_id == user.id)
+        .order_by(last_activity_at.desc(), ChatSummary.chat_id.desc())
+        .limit(limit + 1)
+    )
+    if since is not None:
+        query = query.where(last_activity_at > to_naive_utc(since))
+    if before is not None:
+        query = query.where(
+            tuple_(last_activity_at, ChatSummary.chat_id) < decode_cursor(before),
+        )
+
+    rows = (await session.execute(query)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = [
+        InboxChatRead(
+            id=chat.id,
+            type=chat.type,
+            name=chat.name,
+            image_url=chat.image_url,
+            participants=chat.participants,
+            last_message=message,
+            last_activity_at=activity_at,
+            last_read_message_id=last_read_message_id,
+            unread_count=unread_count,
+        )
+        for chat, message, activity_at, last_read_message_id, unread_count in rows
+    ]
+    return InboxPage(
+        items=items,
+        next_cursor=encode_cursor(items[-1].last_activity_at, items[-1].id)
+        if has_more
+        else None,
+    )
+
+
+async def get_unread_counts(user: User, session: AsyncSession) -> list[ReadStateRead]:
+    query = select(ChatParticipant).where(
+        ChatParticipant.participant_id == user.id,
+        ChatParticipant.unread_count > 0,
+    )
+    return [ReadStateRead.model_validate(p) for p in await session.scalars(query)]
+
+
+async def mark_read(
+    chat_id: int,
+    user_id: int,
+    message_id: int,
+    session: AsyncSession,
+) -> ReadStateRead | None:
+    """
+    Moves the participant's read watermark forward to the message.
+    Returns None if the watermark is already there or the message
+    is not in the chat.
+    """
+    # the row is locked before counting, so that the count is taken after
+    # message writers holding it have committed their increments, otherwise
+    # the count of an older snapshot would overwrite them
+    await session.execute(
+        select(ChatParticipant.chat_id)
+        .where(
+            ChatParticipant.chat_id == chat_id,
+            ChatParticipant.participant_id == user_id,
+        )
+        .with_for_update(),
+    )
+    # usually nothing or a few messages are left after the watermark
+    unread_count = (
+        select(func.count())
+        .where(
+            Message.chat_id == chat_id,
+            Message.id > message_id,
+            Message.author_id != user_id,
+        )
+        .scalar_subquery()
+    )
+    query = (
+        update(ChatParticipant)
+        .where(
+            ChatParticipant.chat_id == chat_id,
+            ChatParticipant.participant_id == user_id,
+            or_(
+                ChatParticipant.last_read_message_id.is_(None),
+                ChatParticipant.last_read_message_id < message_id,
+            ),
+            select(Message.id)
+            .where(Message.id == message_id, Message.chat_id == chat_id)
+            .exists(),
+        )
+        .values(last_read_message_id=message_id, unread_count=unread_count)
+        .returning(
+            ChatParticipant.chat_id,
+            ChatParticipant.last_read_message_id,
+            ChatParticipant.unread_count,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    row = (await session.execute(query)).one_or_none()
+    await session.commit()
+    return ReadStateRead.model_validate(row) if row else None
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    """Returns the start of the month `months` after the one of `value`."""
+    month = value.month - 1 + months
+    return datetime(value.year + month // 12, month % 12 + 1, 1)  # noqa: DTZ001
+
+
+def _parse_partition_bound(value: str) -> datetime | None:
+    return None if value == "MINVALUE" else datetime.fromisoformat(value.strip("'"))
+
+
+async def get_message_partitions(session: AsyncSession) -> list[MessagePartition]:
+    """Returns partitions of the message table, oldest first."""
+    query = text(
+        """
+        SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+        FROM pg_inherits
+        JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = 'message'::regclass
+        """,
+    )
+    partitions = []
+    for name, bound in await session.execute(query):
+        lower, upper = PARTITION_BOUND_PATTERN.search(bound).groups()
+        partitions.append(
+            MessagePartition(
+                name,
+                _parse_partition_bound(lower),
+                _parse_partition_bound(upper),
+            ),
+        )
+    return sorted(partitions, key=lambda partition: partition.upper)
+
+
+async def create_message_partitions(
+    session: AsyncSession,
+    months_ahead: int,
+) -> list[str]:
+    """
+    Creates monthly partitions of the message table following the last one,
+    up to `months_ahead` months after the current one. Returns their names.
+    """
+    # creation dates are stored without a time zone, in UTC
+    now = datetime.now(UTC).replace(tzinfo=None)
+    await session.execute(select(func.pg_advisory_xact_lock(MESSAGE_PARTITION_LOCK_ID)))
+    partitions = await get_message_partitions(session)
+    lower = partitions[-1].upper if partitions else add_months(now, 0)
+
+    created = []
+    while lower < add_months(now, months_ahead + 1):
+        upper = add_months(lower, 1)
+        name = f"message_p{lower:%Y_%m}"
+        await session.execute(
+            text(
+                f"CREATE TABLE {name} PARTITION OF message "
+                f"FOR VALUES FROM ('{lower}') TO ('{upper}')",
+            ),
+        )
+        created.append(name)
+        lower = upper
+
+    await session.commit()
+    return created
+
+
+async def send_error(
+    websocket: WebSocket,
+    error: dict,
+    codec: Codec = json_codec,
+) -> None:
+    await codec.send(websocket, codec.encode({"error": error}))
 
 
 async def create_message(
     message: dict,
     user: User,
-    session: AsyncSession,
+    chat_ids: set[int],
+    message_writer: "MessageWriter",
 ) -> WSMessageRead:
     message = MessageCreate(**message)
 
-    # make sure chat exists and user is a participant
-    query = select(Chat.id).where(
-        Chat.id == message.chat_id,
-        ChatParticipant.participant_id == user.id,
-    )
-    result = await session.execute(query)
-    if not result.scalar():
+    # make sure user is a participant, chat_ids is loaded once per connection
+    if message.chat_id not in chat_ids:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
 
     message_data = message.model_dump()
@@ -35,10 +550,10 @@ async def create_message(
             "sender_id": user.id,
         },
     )
-    new_message = Message(**message_data)
-
-    session.add(new_message)
-    await session.commit()
-    await session.refresh(new_message)
+    try:
+        new_message = await message_writer.write(message_data)
+    except IntegrityError as e:
+        # chat has been deleted in the meantime
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND) from e
 
     return WSMessageRead.model_validate(new_message)
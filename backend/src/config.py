@@ -10,6 +10,9 @@ DEBUG = config["common"]["debug"]
 # Auth
 SECRET_KEY = config["auth"]["secret_key"]
 ALGORITHM = "HS256"
+SIGNED_ACCESS_TOKENS = config["auth"]["signed_access_tokens"]
+PASSWORD_HASH_WORKERS = config["auth"]["password_hash_workers"]
+PASSWORD_HASH_MAX_QUEUED = config["auth"]["password_hash_max_queued"]
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 30 * 6
 
@@ -22,7 +25,31 @@ DATABASE_PORT = config["database"]["port"]
 DATABASE_USER = config["database"]["user"]
 DATABASE_PASSWORD = config["database"]["password"]
 DATABASE_NAME = config["database"]["name"]
+DATABASE_POOL_SIZE = config["database"]["pool_size"]
+DATABASE_MAX_OVERFLOW = config["database"]["max_overflow"]
+DATABASE_POOL_TIMEOUT = config["database"]["pool_timeout"]
+DATABASE_POOL_RECYCLE = config["database"]["pool_recycle"]
+DATABASE_STATEMENT_CACHE_SIZE = config["database"]["statement_cache_size"]
 DATABASE_URL = f"postgresql+asyncpg://{DATABASE_USER}:{DATABASE_PASSWORD}@{DATABASE_HOST}:{DATABASE_PORT}/{DATABASE_NAME}"
 
-# Redis
-REDIS_URL = config["redis"]["url"]
+# Storage
+STORAGE_PATH = Path(config["storage"]["path"])
+STORAGE_MAX_FILE_SIZE = config["storage"]["max_file_size"]
+
+# Broadcast
+BROADCAST_URL = config["broadcast"]["url"]
+BROADCAST_QUEUE_SIZE = config["broadcast"]["queue_size"]
+BROADCAST_OVERFLOW_POLICY = config["broadcast"]["overflow_policy"]
+# backend specific options keyed by backend, e.g. publish batching for Redis
+BROADCAST_BACKEND_OPTIONS = {
+    name: options
+    for name, options in config["broadcast"].items()
+    if isinstance(options, dict)
+}
+
+# Chat
+# new messages are inserted in batches of up to message_batch_size
+# collected within message_batch_window seconds
+MESSAGE_BATCH_SIZE = config["chat"]["message_batch_size"]
+MESSAGE_BATCH_WINDOW = config["chat"]["message_batch_window"]
+READ_RECEIPT_WINDOW = config["chat"]["read_receipt_window"]
@@ -3,15 +3,42 @@ from collections.abc import AsyncGenerator
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import declarative_base, sessionmaker
 
-from .config import DATABASE_URL, DEBUG
+from .config import (
+    DATABASE_MAX_OVERFLOW,
+    DATABASE_POOL_RECYCLE,
+    DATABASE_POOL_SIZE,
+    DATABASE_POOL_TIMEOUT,
+    DATABASE_STATEMENT_CACHE_SIZE,
+    DATABASE_URL,
+    DEBUG,
+)
 
-engine = create_async_engine(DATABASE_URL, future=True, echo=DEBUG)
+engine = create_async_engine(
+    DATABASE_URL,
+    future=True,
+    echo=DEBUG,
+    pool_size=DATABASE_POOL_SIZE,
+    max_overflow=DATABASE_MAX_OVERFLOW,
+    pool_timeout=DATABASE_POOL_TIMEOUT,
+    pool_recycle=DATABASE_POOL_RECYCLE,
+    connect_args={
+        # SQLAlchemy's cache of prepared statements
+        "prepared_statement_cache_size": DATABASE_STATEMENT_CACHE_SIZE,
+        # asyncpg's own cache, used for queries made through the driver directly
+        "statement_cache_size": DATABASE_STATEMENT_CACHE_SIZE,
+    },
+)
 
 Base = declarative_base()
 
 _AsyncSession = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 
 
+def create_session() -> AsyncSession:
+    """Creates a session for code that doesn't run inside of a request."""
+    return _AsyncSession()
+
+
 # Dependency
 async def get_db_session() -> AsyncGenerator[AsyncSession]:
     async with _AsyncSession() as session:
@@ -33,3 +33,4 @@ class WSError(LabeledEnum):
     TOKEN_EXPIRED = 4002, "Token has expired"
     INACTIVE_USER = 4003, "Inactive user"
     VALIDATION_ERROR = 4004, "Validation error"
+    SLOW_CONSUMER = 4005, "Connection is too slow"
@@ -2,6 +2,7 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from .auth.router import router as auth_router
+from .broadcast import broadcast
 from .chat.router import router as chat_router
 from .config import ALLOWED_ORIGINS
 
@@ -9,6 +10,8 @@ app = FastAPI(
     title="Webchat",
     description="Welcome to Webchat's API documentation! Here you will be able to discover all of the ways you can interact with the Webchat API.",  # noqa: E501
     version="0.1.0",
+    # routers' startup handlers may already use the broadcast
+    on_startup=[broadcast.connect],
 )
 
 app.add_middleware(
@@ -21,3 +24,6 @@ app.add_middleware(
 
 app.include_router(auth_router)
 app.include_router(chat_router)
+
+# disconnect once routers' shutdown handlers are done with the broadcast
+app.add_event_handler("shutdown", broadcast.disconnect)
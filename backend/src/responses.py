@@ -0,0 +1,131 @@
+import os
+import re
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.types import Receive, Scope, Send
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def accepts_encoding(accept_encoding: str, encoding: str) -> bool:
+    """
+    Tells whether the Accept-Encoding header allows the content coding,
+    i.e. it's listed, or matched by "*", with a non-zero q-value.
+    """
+    qvalues = {}
+    for item in accept_encoding.lower().split(","):
+        coding, *params = (part.strip() for part in item.split(";"))
+        qvalue = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    qvalue = float(value)
+                except ValueError:
+                    qvalue = 0.0
+        if coding:
+            qvalues[coding] = qvalue
+    return qvalues.get(encoding, qvalues.get("*", 0.0)) > 0
+
+
+class RangeFileResponse(FileResponse):
+    """
+    File response that serves a single byte range of the file if requested.
+    The file or its range is sent by the server without passing through
+    Python if it supports the zero-copy send extension, otherwise it's read
+    in chunks.
+    """
+
+    def _get_range(self: "RangeFileResponse", scope: Scope) -> tuple[int, int] | None:
+        """Returns the requested range as (start, end), end is exclusive."""
+        headers = Headers(scope=scope)
+        match = RANGE_PATTERN.match(headers.get("range", "").replace(" ", ""))
+        # multiple ranges are not supported, the whole file is sent instead
+        if match is None or not any(match.groups()):
+            return None
+        # the file has changed since the client got the first part of it
+        if_range = headers.get("if-range")
+        if if_range is not None and if_range != self.headers["etag"]:
+            return None
+
+        size = self.stat_result.st_size
+        start, end = match.groups()
+        # invalid rather than unsatisfiable, so the header is ignored
+        if start and end and int(end) < int(start):
+            return None
+        if not start:
+            # the last `end` bytes
+            return max(size - int(end), 0), size
+        return int(start), min(int(end) + 1, size) if end else size
+
+    async def __call__(
+        self: "RangeFileResponse",
+        scope: Scope,
+        receive: Receive,  # noqa: ARG002
+        send: Send,
+    ) -> None:
+        if self.stat_result is None:
+            self.stat_result = await anyio.to_thread.run_sync(os.stat, self.path)
+            self.set_stat_headers(self.stat_result)
+        self.headers["accept-ranges"] = "bytes"
+
+        size = self.stat_result.st_size
+        byte_range = self._get_range(scope)
+        # the whole file is sent the same way as a range of it
+        start, end = byte_range or (0, size)
+        if byte_range is not None and start >= end:
+            self.status_code = 416
+            self.headers["content-range"] = f"bytes */{size}"
+            self.headers["content-length"] = "0"
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": self.status_code,
+                    "headers": self.raw_headers,
+                },
+            )
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if byte_range is not None:
+            self.status_code = 206
+            self.headers["content-range"] = f"bytes {start}-{end - 1}/{size}"
+            self.headers["content-length"] = str(end - start)
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            },
+        )
+        if scope["method"].upper() == "HEAD" or start == end:
+            await send({"type": "http.response.body", "body": b""})
+        elif "http.response.zerocopysend" in scope.get("extensions", {}):
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                await send(
+                    {
+                        "type": "http.response.zerocopysend",
+                        "file": file.wrapped,
+                        "offset": start,
+                        "count": end - start,
+                    },
+                )
+        else:
+            async with await anyio.open_file(self.path, mode="rb") as file:
+                await file.seek(start)
+                remaining = end - start
+                while remaining:
+                    chunk = await file.read(min(self.chunk_size, remaining))
+                    # stop early if the file has been truncated meanwhile
+                    remaining = remaining - len(chunk) if chunk else 0
+                    await send(
+                        {
+                            "type": "http.response.body",
+                            "body": chunk,
+                            "more_body": bool(remaining),
+                        },
+                    )
+        if self.background is not None:
+            await self.background()
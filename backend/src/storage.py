@@ -0,0 +1,142 @@
+import hashlib
+import re
+import secrets
+import time
+from pathlib import Path
+
+import anyio
+from anyio import AsyncFile
+
+from .config import STORAGE_PATH
+
+# size of the chunks an interrupted upload is read in to hash it again
+HASH_CHUNK_SIZE = 1024 * 1024
+UPLOAD_ID_PATTERN = r"^[A-Za-z0-9_-]{22}$"
+DIGEST_PATTERN = r"^[0-9a-f]{64}$"
+
+
+class Upload:
+    """A file being written to the store chunk by chunk as it's received."""
+
+    def __init__(
+        self: "Upload",
+        path: Path,
+        file: AsyncFile[bytes],
+        hasher: "hashlib._Hash",
+        received: int,
+    ) -> None:
+        # uploads are stored under their id
+        self.id = path.name
+        self.path = path
+        self._file = file
+        self._hasher = hasher
+        self.received = received
+
+    async def write(self: "Upload", chunk: bytes) -> None:
+        await self._file.write(chunk)
+        self._hasher.update(chunk)
+        self.received += len(chunk)
+
+    async def close(self: "Upload") -> None:
+        await self._file.aclose()
+
+    def hexdigest(self: "Upload") -> str:
+        return self._hasher.hexdigest()
+
+
+def _hash_file(path: Path, hasher: "hashlib._Hash") -> None:
+    with path.open("rb") as file:
+        while chunk := file.read(HASH_CHUNK_SIZE):
+            hasher.update(chunk)
+
+
+def _remove_stale_files(path: Path, modified_before: float) -> int:
+    removed = 0
+    for owner_path in path.glob("*"):
+        for file_path in owner_path.glob("*"):
+            # it might have been resumed or finished meanwhile
+            try:
+                if file_path.stat().st_mtime < modified_before:
+                    file_path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                continue
+    # directories of owners are kept, new uploads might be started in them
+    return removed
+
+
+class BlobStore:
+    """
+    Content-addressed store of files on the local disk. Files are named by
+    the sha256 of their content, so identical files are stored once. Uploads
+    are written to a file of their own and moved into place once complete,
+    so an interrupted upload can be resumed from the bytes received so far.
+    """
+
+    def __init__(self: "BlobStore", path: Path) -> None:
+        self._blobs_path = path / "blobs"
+        self._uploads_path = path / "uploads"
+
+    def get_path(self: "BlobStore", digest: str) -> Path:
+        """Raises ValueError if `digest` is not a sha256 hex digest."""
+        # anything else could point outside of the store
+        if not re.match(DIGEST_PATTERN, digest):
+            msg = "Invalid digest"
+            raise ValueError(msg)
+        # nested by the digest prefix, so that directories stay small
+        return self._blobs_path / digest[:2] / digest[2:4] / digest
+
+    async def open_upload(
+        self: "BlobStore",
+        owner_id: int,
+        upload_id: str | None = None,
+    ) -> Upload:
+        """
+        Starts a new upload or resumes the owner's upload with the given id,
+        raises FileNotFoundError if there is no such upload.
+        """
+        hasher = hashlib.sha256()
+        if upload_id is None:
+            upload_id = secrets.token_urlsafe(16)
+            path = self._uploads_path / str(owner_id) / upload_id
+            await anyio.Path(path.parent).mkdir(parents=True, exist_ok=True)
+            received = 0
+        else:
+            path = self._uploads_path / str(owner_id) / upload_id
+            received = (await anyio.Path(path).stat()).st_size
+            # the hash state isn't kept, so the received part is hashed again
+            await anyio.to_thread.run_sync(_hash_file, path, hasher)
+
+        file = await anyio.open_file(path, "ab")
+        return Upload(path, file, hasher, received)
+
+    async def finish(self: "BlobStore", upload: Upload) -> str:
+        """Moves a complete upload into the store, returns its digest."""
+        await upload.close()
+        digest = upload.hexdigest()
+        path = anyio.Path(self.get_path(digest))
+        if await path.exists():
+            await anyio.Path(upload.path).unlink()
+        else:
+            await path.parent.mkdir(parents=True, exist_ok=True)
+            await anyio.Path(upload.path).replace(path)
+        return digest
+
+    async def abort(self: "BlobStore", upload: Upload) -> None:
+        await upload.close()
+        await anyio.Path(upload.path).unlink(missing_ok=True)
+
+    async def remove_stale_uploads(self: "BlobStore", max_age: float) -> int:
+        """
+        Removes uploads that haven't been written to for `max_age` seconds,
+        they can't be resumed anymore. Returns the number of removed uploads.
+        """
+        return await anyio.to_thread.run_sync(
+            _remove_stale_files,
+            self._uploads_path,
+            time.time() - max_age,
+        )
+
+
+# shared by all routers of the node
+blob_store = BlobStore(STORAGE_PATH)
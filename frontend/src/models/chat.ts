@@ -5,15 +5,20 @@ export interface Message {
   chatId: number;
   type: number;
   content: string
-  isRead: boolean;
   isEdited: boolean;
   createdAt: string;
 }
 
+export interface MessagePage {
+  // newest first
+  items: Message[];
+  nextCursor: string | null;
+  prevCursor: string | null;
+}
+
 export interface PreviewMessage {
   content: string;
   createdAt: string;
-  isRead: boolean;
 }
 
 export interface User {
@@ -46,6 +51,27 @@ export interface ChatResponse {
   messages: Message[];
 }
 
+export interface InboxChat {
+  id: number;
+  name?: string;
+  type: ChatType;
+  imageUrl?: string;
+  participants: Participant[];
+  lastMessage: Message | null;
+  lastActivityAt: string;
+  lastReadMessageId: number | null;
+  unreadCount: number;
+}
+
+export interface InboxPage {
+  // most recently active first
+  items: InboxChat[];
+  nextCursor: string | null;
+}
+
 export interface Chat extends ChatResponse {
   previewMessage?: PreviewMessage;
+  unreadCount?: number;
+  // cursor of the older messages page, null when the history is fully loaded
+  nextCursor?: string | null;
 }
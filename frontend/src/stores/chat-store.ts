@@ -1,7 +1,7 @@
 import { defineStore } from 'pinia';
 import { api } from 'src/boot/axios';
 import { useNotifications } from 'src/composables/notifications';
-import { Chat, ChatResponse, Message, PreviewMessage } from 'src/models/chat';
+import { Chat, ChatResponse, InboxPage, Message, MessagePage, PreviewMessage } from 'src/models/chat';
 import { ChatType } from 'src/services/constants';
 import router from 'src/router/index';
 import { ref, watch } from 'vue';
@@ -14,6 +14,7 @@ export const useChatStore = defineStore('chat', () => {
 
   const currentChat = ref<Chat | null>(null);
   const chats = ref<Chat[]>([]);
+  const inboxCursor = ref<string | null>(null);
 
   watch(
     () => route.query.id,
@@ -48,13 +49,25 @@ export const useChatStore = defineStore('chat', () => {
     }
   }
 
-  async function getChats() {
-    chats.value = [];
+  async function getChats(before: string | null = null) {
+    if (!before) {
+      chats.value = [];
+    }
 
     try {
-      const { data } = await api.get<ChatResponse[]>('chats');
-
-      data.forEach(chat => {
+      const { data } = await api.get<InboxPage>('chats/inbox', {
+        params: {
+          before
+        }
+      });
+      inboxCursor.value = data.nextCursor;
+
+      data.items.forEach(({ lastMessage, ...inboxChat }) => {
+        // only the last message is loaded, the history is fetched on opening the chat
+        const chat: ChatResponse = {
+          ...inboxChat,
+          messages: lastMessage ? [lastMessage] : []
+        };
         (chat as Chat | null).previewMessage = setUpPreviewMessage(chat);
         if (chat.type === ChatType.SAVED_MESSAGES) {
           chat.name = "Saved Messages"
@@ -103,20 +116,20 @@ export const useChatStore = defineStore('chat', () => {
     }
   }
 
-  async function getMessages(chatId: number, limit: number | null = null, offset: number | null = null) {
+  async function getMessages(chatId: number, before: string | null = null, limit: number | null = null) {
     try {
-      const { data } = await api.get<Message[]>(`chats/${chatId}/messages`, {
+      const { data } = await api.get<MessagePage>(`chats/${chatId}/messages`, {
         params: {
-          limit,
-          offset
+          before,
+          limit
         }
       });
 
       for (const chat of chats.value) {
         if (chat.id === chatId) {
-          chat.messages.push(...data);
-          console.log(chat.messages);
-          
+          // pages come newest first, older messages go before the loaded ones
+          chat.messages.unshift(...data.items.reverse());
+          chat.nextCursor = data.nextCursor;
           break
         }
       }
@@ -149,7 +162,6 @@ export const useChatStore = defineStore('chat', () => {
       return {
         content: lastMessage.content,
         createdAt: formatCreationDate(lastMessage.createdAt),
-        isRead: lastMessage.isRead,
       };
     }
     return null;
@@ -171,6 +183,7 @@ export const useChatStore = defineStore('chat', () => {
   return {
     currentChat,
     chats,
+    inboxCursor,
     getDialogParticipant,
     getDisplayName,
     getChats,
@@ -133,9 +133,15 @@ export const useUserStore = defineStore('user', () => {
     }
   }
 
-  async function searchUsers(q: string) {
+  async function searchUsers(q: string, prefix = false, limit: number | null = null) {
     try {
-      const { data } = await api.get(`users/search/?q=${q}`);
+      const { data } = await api.get('users/search', {
+        params: {
+          q,
+          prefix,
+          limit
+        }
+      });
 
       return data
     } catch (error) {